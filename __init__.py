@@ -9,6 +9,11 @@ from .cwlFile import (
 
 from .cwlRunner import (
     CWLRunner,
+    CWLRunnerPool,
+)
+
+from .cwlWorker import (
+    CWLWorker,
 )
 
 from .mafio import (
@@ -27,6 +32,7 @@ from .plutoTestCase import (
 from .run import (
     run_cwl,
     run_command,
+    run_command_stream,
     run_cwl_toil
 )
 
@@ -56,15 +62,38 @@ from .settings import (
     PRINT_STATS,
     CWL_ARGS,
     TOIL_ARGS,
+    CWL_CACHE_DIR,
+    CWL_PARALLEL,
+    CWL_DAEMON,
+    CWL_CONCURRENT_RUNS,
     TOIL_CLEAN_SETTINGS,
 )
 
 from .util import (
     write_table,
+    open_gzip,
     dicts2lines,
+    write_dicts,
     clean_dicts,
+    clean_dicts_copy,
+    related_keys_map,
+    replace_in_strings,
     parse_header_comments,
+    read_header_comments,
     load_mutations,
+    iter_mutations,
+    load_mutations_many,
+    load_mutations_rows,
+    load_mutations_np,
+    load_mutations_arrow,
+    rows2dicts,
     md5_file,
-    md5_obj
+    md5_files,
+    hash_file,
+    file_digests,
+    md5_obj,
+    write_json,
+    write_ndjson,
+    read_ndjson,
+    loads_json
 )
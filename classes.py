@@ -169,3 +169,11 @@ class PrintToilStats(BooleanSettingBaseClass):
 class SaveToilStats(BooleanSettingBaseClass):
     def __init__(self, value: str, *args, **kwargs) -> None:
         super().__init__(value, *args, **kwargs)
+
+class CWLParallel(BooleanSettingBaseClass):
+    def __init__(self, value: str, *args, **kwargs) -> None:
+        super().__init__(value, *args, **kwargs)
+
+class CWLDaemon(BooleanSettingBaseClass):
+    def __init__(self, value: str, *args, **kwargs) -> None:
+        super().__init__(value, *args, **kwargs)
@@ -1,10 +1,25 @@
 import os
+import sys
+from functools import lru_cache
 from .settings import CWL_DIR as _CWL_DIR
 
-class CWLFile(os.PathLike):
+@lru_cache(maxsize = 256)
+def _resolve_cwl_path(path: str, CWL_DIR: str) -> str:
+    """
+    Get the full path to a CWL file; cached since the same CWL files get looked up over and over across test cases
+
+    The path is interned so that every CWLFile for the same file shares one string, even after it drops out of the cache
+    """
+    return(sys.intern(os.path.join(CWL_DIR, path)))
+
+# NOTE: does not inherit from os.PathLike because its base class has no __slots__ which would give every instance a __dict__;
+# isinstance(cwl_file, os.PathLike) is still True because os.PathLike recognizes any class that implements __fspath__
+class CWLFile(object):
     """
     Wrapper class to locate the full path to a cwl file more conveniently
     """
+    __slots__ = ("path",)
+
     def __init__(self, path: str, CWL_DIR: str = None):
         """
         Parameters
@@ -23,7 +38,7 @@ class CWLFile(os.PathLike):
         """
         if CWL_DIR is None:
             CWL_DIR = _CWL_DIR
-        self.path = os.path.join(CWL_DIR, path)
+        self.path = _resolve_cwl_path(os.fspath(path), CWL_DIR)
     def __str__(self):
         return(self.path)
     def __repr__(self):
@@ -1,13 +1,14 @@
 import os
-import json
 import unittest
-from pathlib import Path
-from typing import Dict, Tuple, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Tuple, Union, List
 from .settings import (
     PRINT_COMMAND,
     TOIL_STATS,
+    CWL_PARALLEL,
 )
 from .cwlFile import CWLFile
+from .util import write_json, write_ndjson, loads_json
 from .run import (
     run_command,
     run_cwl,
@@ -44,7 +45,8 @@ class CWLRunner(object):
         js_console: bool = False,
         print_stderr: bool = False,
         use_cache: bool = True,
-        toil_stats: bool = None # if follow-up steps should be taken to collect Toil run stats; assumes that TOIL_ARGS has been updated for including the --stats flag which creates required output in the jobstore
+        toil_stats: bool = None, # if follow-up steps should be taken to collect Toil run stats; assumes that TOIL_ARGS has been updated for including the --stats flag which creates required output in the jobstore
+        ndjson: bool = False # write the output to output.ndjson with one output per line, instead of to output.json
         ):
         """
         Examples
@@ -78,6 +80,7 @@ class CWLRunner(object):
         self.js_console = js_console
         self.print_stderr = print_stderr
         self.use_cache = use_cache
+        self.ndjson = ndjson
         self.toil_stats = toil_stats
         self.toil_stats_dict = {}
 
@@ -86,6 +89,8 @@ class CWLRunner(object):
             self.print_command = PRINT_COMMAND
         if TOIL_STATS:
             self.toil_stats = TOIL_STATS
+        if CWL_PARALLEL:
+            self.parallel = True
 
         if dir is None:
             if engine == 'cwltool':
@@ -101,8 +106,8 @@ class CWLRunner(object):
             # else:
             #     dir = "pipeline_output"
 
-        Path(os.path.abspath(dir)).mkdir(parents=True, exist_ok=True)
         self.dir = os.path.abspath(dir)
+        os.makedirs(self.dir, exist_ok = True)
 
     def run(self) -> Tuple[int, str, str]:
         """
@@ -153,9 +158,14 @@ class CWLRunner(object):
             # This should probably raise an error
             raise InvalidEngine(">>> ERROR: invalid engine provided: {}. Try 'cwltool' or 'toil'".format(self.engine))
 
-        output_json_file = os.path.join(self.dir, "output.json")
-        with open(output_json_file, "w") as fout:
-            json.dump(output_json, fout, indent = 4)
+        if self.ndjson:
+            # one output per line so the outputs can be read back one at a time with read_ndjson
+            output_json_file = os.path.join(self.dir, "output.ndjson")
+            write_ndjson(output_json, output_json_file)
+        else:
+            output_json_file = os.path.join(self.dir, "output.json")
+            # only indent the output JSON when it is meant to be read by a person
+            write_json(output_json, output_json_file, pretty = self.verbose)
         return(output_json, output_dir, output_json_file)
 
     def get_toil_stats(self, jobStore: str) -> Dict:
@@ -164,7 +174,7 @@ class CWLRunner(object):
         """
         command = ["toil", "stats", "--raw", jobStore]
         returncode, proc_stdout, proc_stderr = run_command(command)
-        stats = json.loads(proc_stdout)
+        stats = loads_json(proc_stdout)
         return(stats)
 
     # def format_toil_stats(self):
@@ -174,3 +184,48 @@ class CWLRunner(object):
     #     if self.toil_stats_dict.get('worker'):
     #         d['total_number'] = self.toil_stats_dict['worker'].get('total_number')
 
+
+class CWLRunnerPool(object):
+    """
+    class for running several independent CWLRunner's at the same time
+
+    Note
+    ----
+    Uses threads because all the work for each run happens in the `cwl-runner` or `toil-cwl-runner` subprocess;
+    make sure each runner has its own `dir`, and all Singularity containers are cached first if they need to be pulled
+
+    Examples
+    --------
+    Example usage::
+
+        runners = [ CWLRunner(cwl_file = cwl_file, input = input, dir = dir) for input, dir in zip(inputs, dirs) ]
+        with CWLRunnerPool(max_workers = 4) as pool:
+            results = pool.run(runners)
+        for output_json, output_dir, output_json_file in results:
+            ...
+    """
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers = max_workers)
+
+    def submit(self, runner: CWLRunner) -> Future:
+        """
+        Start running a CWLRunner in the pool, returns a Future for the results of `runner.run()`
+        """
+        return(self.executor.submit(runner.run))
+
+    def run(self, runners: List[CWLRunner]) -> List[ Tuple[Dict, str, str] ]:
+        """
+        Run all the CWLRunner's in the pool and wait for them to finish; results are returned in the same order as `runners`
+        """
+        futures = [ self.submit(runner) for runner in runners ]
+        return([ future.result() for future in futures ])
+
+    def shutdown(self):
+        self.executor.shutdown(wait = True)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.shutdown()
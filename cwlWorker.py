@@ -0,0 +1,116 @@
+"""
+Long-lived worker process for running cwltool
+
+Each `cwl-runner` command normally starts a new Python interpreter that has to import cwltool and its schema libraries again,
+which can take longer than running a small CWL itself.
+The worker imports cwltool one time and then runs each CWL it is sent with `cwltool.main.main`,
+so that cost is only paid once per test session.
+
+Enable it with the `CWL_DAEMON` environment variable; see `run_cwl`
+"""
+import io
+import atexit
+import threading
+from typing import List, Tuple, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    # only imported for the type annotations; the worker process is started with multiprocessing when it is first used
+    from multiprocessing.connection import Connection
+
+
+def _worker_loop(conn: 'Connection'):
+    """
+    Runs inside the worker process; receives lists of cwltool args and sends back `(returncode, stdout, stderr)` for each one,
+    until it receives `None` or the connection is closed
+    """
+    import cwltool.main
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        if args is None:
+            break
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        try:
+            returncode = cwltool.main.main(argsl = args, stdout = stdout, stderr = stderr)
+        except Exception as e: # send the error back instead of killing the worker
+            returncode = 1
+            stderr.write(repr(e))
+        conn.send((returncode, stdout.getvalue().strip(), stderr.getvalue().strip()))
+
+
+class CWLWorker(object):
+    """
+    Handle for a worker process that runs cwltool without starting a new interpreter for each run
+
+    Note
+    ----
+    A worker runs one CWL at a time; `run` returns `None` if the worker is already busy with another run (e.g. from `CWLRunnerPool`)
+    or has died, so that the caller can fall back to running `cwl-runner` as a separate command instead
+
+    Examples
+    --------
+    Example usage::
+
+        worker = CWLWorker()
+        returncode, proc_stdout, proc_stderr = worker.run([ "--outdir", output_dir, cwl_file, input_json_file ])
+        worker.close()
+    """
+    def __init__(self):
+        import multiprocessing
+        # use spawn instead of fork so the worker does not inherit any state from the test process
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target = _worker_loop, args = (child_conn,), daemon = True)
+        self.process.start()
+        child_conn.close()
+        self.lock = threading.Lock()
+        self.alive = True
+
+    def run(self, args: List[str]) -> Optional[ Tuple[int, str, str] ]:
+        """
+        Run cwltool in the worker with the given command line args (not including the `cwl-runner` executable itself)
+        """
+        if not self.alive or not self.lock.acquire(blocking = False):
+            return(None)
+        try:
+            self.conn.send([ str(arg) for arg in args ])
+            result = self.conn.recv()
+        except (EOFError, OSError):
+            # worker process died
+            self.alive = False
+            return(None)
+        finally:
+            self.lock.release()
+        return(result)
+
+    def close(self):
+        """
+        Stop the worker process
+        """
+        if self.alive:
+            self.alive = False
+            try:
+                self.conn.send(None)
+            except (EOFError, OSError):
+                pass
+        self.process.join(timeout = 10)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+_worker: Optional[CWLWorker] = None
+_worker_lock = threading.Lock()
+
+def get_worker() -> CWLWorker:
+    """
+    Get the shared CWLWorker, starting it the first time it is needed; it gets stopped when the process exits
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = CWLWorker()
+            atexit.register(_worker.close)
+    return(_worker)
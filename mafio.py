@@ -1,10 +1,17 @@
+import re
 import csv
-from typing import TextIO, List, Dict, Generator
+from operator import itemgetter
+from typing import IO, TextIO, List, Dict, Generator, Iterator, Callable
 from .util import (
+    open_gzip,
     dicts2lines,
-    parse_header_comments,
+    read_header_comments,
+    rows2dicts,
 )
 
+# the end of a line that has some content on it; blank lines are skipped when reading the table
+_non_blank_line_end = re.compile(rb'[^\r\n]\r?\n')
+
 
 class TableReader(object):
     """
@@ -55,47 +62,142 @@ class TableReader(object):
         self.delimiter = delimiter
         # get the comments from the file and find the beginning of the table header
         self.comments = None
-        self.comment_lines = []
-        self.comments, self.start_line = parse_header_comments(filename, comment_char = self.comment_char, ignore_comments = ignore_comments)
-        if self.comments:
-            self.comment_lines = [ c + '\n' for c in self.comments ]
+        self._comment_lines = None
+        # read the comments and the header line in a single pass and save the position of the first record
+        # so that the header does not need to be parsed again every time the records are read
+        with self.open() as fin:
+            self.comments, self.start_line, header_line = read_header_comments(fin, comment_char = self.comment_char, ignore_comments = ignore_comments)
+            self.fieldnames = None
+            if header_line:
+                self.fieldnames = next(csv.reader([header_line], delimiter = self.delimiter))
+            self.data_offset = fin.tell()
+
+    @property
+    def comment_lines(self) -> List[str]:
+        """
+        list of the comment lines from the file with newlines appended, built the first time it is requested
+        """
+        if self._comment_lines is None:
+            self._comment_lines = list(self.iter_comment_lines())
+        return(self._comment_lines)
+
+    @comment_lines.setter
+    def comment_lines(self, comment_lines: List[str]):
+        self._comment_lines = comment_lines
+
+    def iter_comment_lines(self) -> Iterator[str]:
+        """
+        iterable of the comment lines from the file with newlines appended,
+        use this to write the comments out without building a list of them first
+
+        Examples
+        --------
+        Example usage::
+
+            writer = MafWriter(fout, fieldnames = table_reader.get_fieldnames(), comments = table_reader.iter_comment_lines())
+        """
+        return( c + '\n' for c in (self.comments or ()) )
+
+    def open(self, mode: str = 'rt') -> IO:
+        """
+        returns a file handle for the table, handles .gz files automatically; the file is opened as text unless `mode` is binary
+        """
+        if self.filename.endswith('.gz'):
+            return(open_gzip(self.filename, mode))
+        return(open(self.filename, mode))
 
     def get_reader(self, fin: TextIO) -> csv.DictReader:
         """
         returns the csv.DictReader for the table rows, skipping the comments
         """
-        start_line = self.start_line
-        # skip comment lines
-        while start_line > 0:
-            next(fin)
-            start_line -= 1
-        reader = csv.DictReader(fin, delimiter = self.delimiter)
+        # skip comment lines and the header line
+        fin.seek(self.data_offset)
+        reader = csv.DictReader(fin, fieldnames = self.fieldnames, delimiter = self.delimiter)
         return(reader)
 
     def get_fieldnames(self) -> List[str]:
         """
         returns the list of fieldnames for the table
         """
-        with open(self.filename,'r') as fin:
-            reader = self.get_reader(fin)
-            return(reader.fieldnames)
+        return(self.fieldnames)
 
     def read(self) -> Generator[Dict, None, None]:
         """
         iterable to get the record rows from the table, skipping the comments
         """
-        with open(self.filename,'r') as fin:
-            reader = self.get_reader(fin)
-            for row in reader:
+        if not self.fieldnames:
+            return
+        with self.open() as fin:
+            # skip comment lines and the header line
+            fin.seek(self.data_offset)
+            reader = csv.reader(fin, delimiter = self.delimiter)
+            for row in rows2dicts(reader, self.fieldnames):
                 yield(row)
 
+    def read_columns(self, fieldnames: List[str]) -> Generator[Dict, None, None]:
+        """
+        iterable to get only the given columns from the record rows in the table, skipping the comments
+
+        Picks the values out of each row by position instead of building a dict of every column,
+        which is much faster for wide tables like MAF files when only a few columns are needed
+
+        Examples
+        --------
+        Example usage::
+
+            table_reader = TableReader(input_maf_file)
+            depths = [ rec['t_depth'] for rec in table_reader.read_columns(['Hugo_Symbol', 't_depth']) ]
+        """
+        if not self.fieldnames:
+            return
+        # raises ValueError if a column is not in the table
+        indexes = [ self.fieldnames.index(name) for name in fieldnames ]
+        num_fields = len(self.fieldnames)
+        get_values: Callable[[List[str]], tuple]
+        if len(indexes) == 0:
+            # itemgetter needs at least one index; an empty selection gives an empty dict per row
+            get_values = lambda row: ()
+        elif len(indexes) == 1:
+            # itemgetter with a single index returns the value instead of a tuple
+            get_values = lambda row: (row[indexes[0]],)
+        else:
+            get_values = itemgetter(*indexes)
+        with self.open() as fin:
+            # skip comment lines and the header line
+            fin.seek(self.data_offset)
+            for row in csv.reader(fin, delimiter = self.delimiter):
+                if not row:
+                    continue
+                if len(row) < num_fields:
+                    # fill in missing values with None, same as csv.DictReader
+                    row = row + [ None ] * (num_fields - len(row))
+                yield(dict(zip(fieldnames, get_values(row))))
+
     def count(self) -> int:
         """
         Return the total number of records in the table
+
+        Note
+        ----
+        Counts the non-blank lines in the raw file bytes instead of parsing every row,
+        so assumes there are no quoted fields containing newlines in the table
         """
-        num_records = 0
-        for _ in self.read():
-            num_records += 1
+        if not self.fieldnames:
+            return(0)
+        num_lines = 0
+        # the unfinished last line of each chunk gets carried over to the next one
+        remainder = b''
+        with self.open('rb') as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b''):
+                chunk = remainder + chunk
+                end = chunk.rfind(b'\n') + 1
+                num_lines += len(_non_blank_line_end.findall(chunk, 0, end))
+                remainder = chunk[end:]
+        # count the final line if it does not end with a newline
+        if remainder.strip(b'\r'):
+            num_lines += 1
+        # subtract the comment lines and the header line
+        num_records = max(num_lines - self.start_line - 1, 0)
         return(num_records)
 
 
@@ -130,5 +232,4 @@ class MafWriter(csv.DictWriter):
         super().__init__(f, fieldnames = fieldnames, delimiter = delimiter, lineterminator=lineterminator, *args, **kwargs)
         if comments:
             if write_comments:
-                for line in comments:
-                    f.write(line) # + lineterminator ; comments should have newline appended already
+                f.writelines(comments) # comments should have newline appended already
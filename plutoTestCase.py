@@ -1,12 +1,12 @@
 import unittest
 import os
 import json
-from typing import Dict, Union, Tuple, List
+import atexit
+from typing import Dict, Union, Tuple, List, Iterator
 from datetime import datetime
 from pathlib import Path
 from tempfile import mkdtemp, mkstemp
 import shutil
-from copy import deepcopy
 from .settings import (
     USE_LSF,
     TMP_DIR,
@@ -18,16 +18,23 @@ from .settings import (
     TOIL_STATS,
     PRINT_STATS,
     SAVE_STATS,
-    STATS_DIR
+    STATS_DIR,
+    CWL_CONCURRENT_RUNS
 )
 from .settings import CWL_DIR as _CWL_DIR
 from .cwlFile import CWLFile
-from .cwlRunner import CWLRunner
+from .cwlRunner import CWLRunner, CWLRunnerPool
 from .util import (
     dicts2lines,
     write_table,
+    write_dicts,
     clean_dicts,
+    clean_dicts_copy,
+    related_keys_map,
+    replace_in_strings,
     load_mutations,
+    iter_mutations,
+    load_mutations_many,
     parse_header_comments,
     md5_obj
 )
@@ -42,6 +49,64 @@ from .classes import (
 )
 
 
+# default keys to remove from CWL output dicts in assertCWLDictEqual
+_BAD_KEYS_DEFAULT = frozenset(('nameext', 'nameroot', 'streamable'))
+_BAD_KEYS_TOIL = _BAD_KEYS_DEFAULT.union(('path',))
+
+# emptied tmpdirs from finished test cases that can be reused by the next test cases in the same process,
+# keyed by the test class name and the parent dir the tmpdir was created in
+_TMPDIR_POOL: Dict[Tuple[str, str], List[str]] = {}
+
+# memory-backed dir for PlutoTestCase.use_shm
+_SHM_DIR = "/dev/shm"
+
+# delete entries relative to an open dir fd where the platform supports it (the same as unlinkat/rmdirat in C),
+# so the kernel does not have to look up the full path again for every file
+_USE_DIR_FD = (
+    hasattr(os, 'O_DIRECTORY')
+    and { os.open, os.unlink, os.rmdir } <= os.supports_dir_fd
+    and os.scandir in os.supports_fd
+    )
+
+def _cleanup_dir(path: str, dir_fd: int = None):
+    """
+    Delete all the contents of a directory but keep the directory itself
+
+    Uses the file types from os.scandir instead of stat'ing every entry like shutil.rmtree does;
+    `path` is relative to `dir_fd` when it is given
+    """
+    if not _USE_DIR_FD:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks = False):
+                    _cleanup_dir(entry.path)
+                    os.rmdir(entry.path)
+                else:
+                    os.unlink(entry.path)
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY, dir_fd = dir_fd)
+    try:
+        with os.scandir(fd) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks = False):
+                    _cleanup_dir(entry.name, dir_fd = fd)
+                    os.rmdir(entry.name, dir_fd = fd)
+                else:
+                    os.unlink(entry.name, dir_fd = fd)
+    finally:
+        os.close(fd)
+
+@atexit.register
+def _remove_pooled_tmpdirs():
+    """
+    Delete the pooled tmpdirs when the process exits
+    """
+    for tmpdirs in _TMPDIR_POOL.values():
+        for tmpdir in tmpdirs:
+            shutil.rmtree(tmpdir, ignore_errors = True)
+    _TMPDIR_POOL.clear()
+
+
 class PlutoTestCase(unittest.TestCase):
     """
     An all-in-one `unittest.TestCase` wrapper class that includes a tmpdir, CWLRunner, and other helper functions, to make it easier to create and run unit tests and integration tests for CWL workflows
@@ -79,17 +144,11 @@ class PlutoTestCase(unittest.TestCase):
                     }
                 output_json, output_dir = self.run_cwl()
 
+                # OFile builds the 'location', 'basename', 'class', 'checksum', 'size', and 'path' entries for the file
                 expected_output = {
-                    'output_file': {
-                        'location': 'file://' + os.path.join(output_dir, 'output.maf'),
-                        'basename': 'output.maf',
-                        'class': 'File',
-                        'checksum': 'sha1$39de59ad5d736db692504012ce86d3395685112e',
-                        'size': 109,
-                        'path': os.path.join(output_dir, 'output.maf')
-                        }
+                    'output_file': OFile(name = 'output.maf', dir = output_dir, size = 109, hash = '39de59ad5d736db692504012ce86d3395685112e')
                     }
-                self.assertDictEqual(output_json, expected_output)
+                self.assertCWLDictEqual(output_json, expected_output)
 
                 comments, mutations = self.load_mutations(output_json['output_file']['path'])
 
@@ -106,6 +165,9 @@ class PlutoTestCase(unittest.TestCase):
     maxDiff = None
     # global settings for all test cases in the instance
     cwl_file = None # make sure to override this in subclasses before using the runner
+    # put each tmpdir in memory-backed /dev/shm instead of TMP_DIR, for test cases with small inputs and outputs;
+    # ignored when running with LSF or Toil, or if /dev/shm does not exist
+    use_shm = False
     runner_args = dict(
         leave_outputs = False,
         leave_tmpdir = False,
@@ -175,26 +237,37 @@ class PlutoTestCase(unittest.TestCase):
         # put the CWL input data here; this will get dumped to a JSON file before executing tests
         self.input = {}
 
-        prefix = self.test_label + "."
-
         if PRINT_TESTNAME:
             print("\n>>> starting test: {}".format(self.test_label))
 
         # NOTE: I think there used to be other logic bundled in here at some point, not sure if we need this if/else anymore...
         # if we are using LSF then the tmpdir needs to be created in a location accessible by the whole cluster
         if USE_LSF:
-            Path(TMP_DIR).mkdir(parents=True, exist_ok=True)
-            self.tmpdir = mkdtemp(dir = TMP_DIR, prefix = prefix)
+            parent_dir = TMP_DIR
         # also Toil tmp dir grows to massive sizes so do not use /tmp for it because it fills up
         elif CWL_ENGINE.toil:
-            Path(TMP_DIR).mkdir(parents=True, exist_ok=True)
-            self.tmpdir = mkdtemp(dir = TMP_DIR, prefix = prefix)
+            parent_dir = TMP_DIR
+        # all the files written during the test are temporary so they do not need to go to disk
+        elif self.use_shm and os.path.isdir(_SHM_DIR):
+            parent_dir = _SHM_DIR
         # if a TMP_DIR was passed in the environment variable
         elif TMP_DIR:
-            Path(TMP_DIR).mkdir(parents=True, exist_ok=True)
-            self.tmpdir = mkdtemp(dir = TMP_DIR, prefix = prefix)
+            parent_dir = TMP_DIR
+        else:
+            parent_dir = None
+
+        # reuse an emptied tmpdir left by a previous test case of the same class if there is one;
+        # pooled tmpdirs get used by every test case in the class so they are only named after the class,
+        # tmpdirs that are kept after the tests finish are never pooled so they are named after the test case instead
+        self.tmpdir_pool_key = (type(self).__name__, parent_dir)
+        tmpdir_pool = None if KEEP_TMP else _TMPDIR_POOL.get(self.tmpdir_pool_key)
+        if tmpdir_pool:
+            self.tmpdir = tmpdir_pool.pop()
         else:
-            self.tmpdir = mkdtemp(prefix = prefix)
+            prefix = (self.test_label if KEEP_TMP else type(self).__name__) + "."
+            if parent_dir:
+                Path(parent_dir).mkdir(parents=True, exist_ok=True)
+            self.tmpdir = mkdtemp(dir = parent_dir, prefix = prefix)
 
         # prevent deletion of tmpdir after tests complete
         self.preserve = False
@@ -209,7 +282,8 @@ class PlutoTestCase(unittest.TestCase):
 
         Note
         ----
-        This method will delete `self.tmpdir` unless `self.preserve` is `True`
+        This method will delete `self.tmpdir` unless `self.preserve` is `True`;
+        the emptied tmpdir is kept for reuse by the next test case of the same class and only removed when the process exits
         """
         self.stop_time = datetime.now()
         self.time_elapsed = self.stop_time - self.start_time
@@ -218,13 +292,29 @@ class PlutoTestCase(unittest.TestCase):
         if PRINT_TESTNAME:
             print("\n>>> stopping test: {} ({})".format(self.test_label, self.time_elapsed))
 
-        # remove the tmpdir upon test completion
+        # remove the tmpdir contents upon test completion and return the tmpdir to the pool
         if not self.preserve:
-            PlutoTestCase.rmtree(self.tmpdir)
+            try:
+                _cleanup_dir(self.tmpdir)
+            except OSError:
+                # could not empty the tmpdir (e.g. a read-only subdir) so remove it completely and do not reuse it
+                PlutoTestCase.rmtree(self.tmpdir)
+            else:
+                _TMPDIR_POOL.setdefault(self.tmpdir_pool_key, []).append(self.tmpdir)
 
     @staticmethod
     def rmtree(path):
-        shutil.rmtree(path)
+        """
+        Delete a directory and all of its contents
+
+        Uses the file types from os.scandir instead of stat'ing every entry like shutil.rmtree does,
+        falls back to shutil.rmtree if that fails
+        """
+        try:
+            _cleanup_dir(path)
+            os.rmdir(path)
+        except OSError:
+            shutil.rmtree(path)
 
     def run_cwl(
         self,
@@ -242,7 +332,10 @@ class PlutoTestCase(unittest.TestCase):
         if input is None:
             input = self.input
         if cwl_file is None:
-            cwl_file = CWLFile(self.cwl_file)
+            cwl_file = self.cwl_file
+            # the cwl_file class attribute is usually already a CWLFile so do not resolve it again
+            if not isinstance(cwl_file, CWLFile):
+                cwl_file = CWLFile(cwl_file)
 
         # print a warning if self.input was empty; this is usually an oversight during test dev
         if not input and not allow_empty_input:
@@ -252,11 +345,7 @@ class PlutoTestCase(unittest.TestCase):
         if CWL_ENGINE != CWL_DEFAULT_ENGINE:
             engine = CWL_ENGINE
 
-        # save a file to the run dir to mark that this test has started running
-        filename = "{}.run".format(self.test_label)
-        run_marker_file = os.path.join(self.tmpdir, filename)
-        with open(run_marker_file, "w") as fout:
-            fout.write(str(self.start_time))
+        self._write_run_marker()
 
         runner = CWLRunner(
             cwl_file = cwl_file,
@@ -271,19 +360,91 @@ class PlutoTestCase(unittest.TestCase):
             # leave_outputs = self.leave_outputs
         output_json, output_dir, output_json_file = runner.run()
 
-        # if Toil run stats were retrieved, either save or print them as requested
+        self._handle_toil_stats(runner, self.test_label)
+
+        return(output_json, output_dir)
+
+    def _write_run_marker(self):
+        """
+        Save a file to the run dir to mark that this test has started running
+        """
+        filename = "{}.run".format(self.test_label)
+        run_marker_file = os.path.join(self.tmpdir, filename)
+        with open(run_marker_file, "w") as fout:
+            fout.write(str(self.start_time))
+
+    def _handle_toil_stats(self, runner: CWLRunner, label: str):
+        """
+        If Toil run stats were retrieved by the runner, either save or print them as requested;
+        saved stats go to a file named after `label`
+        """
         if runner.toil_stats_dict:
             if PRINT_STATS:
-                print("\n>>> {} stats:\n{}".format(self.test_label, runner.toil_stats_dict)) # runner.format_toil_stats
+                print("\n>>> {} stats:\n{}".format(label, runner.toil_stats_dict)) # runner.format_toil_stats
 
             if SAVE_STATS:
                 Path(STATS_DIR).mkdir(parents=True, exist_ok=True)
-                filename = "{}.json".format(self.test_label)
+                filename = "{}.json".format(label)
                 stats_output_file = os.path.join(STATS_DIR, filename)
                 with open(stats_output_file, "w") as fout:
                     json.dump(runner.toil_stats_dict, fout, indent = 4)
 
-        return(output_json, output_dir)
+    def run_cwl_batch(
+        self,
+        inputs: List[Dict], # list of CWL input dicts, the CWL will be run once for each one
+        cwl_file: Union[str, CWLFile] = None,
+        engine: str = "cwltool",
+        max_workers: int = None, # max number of CWL runs at the same time, defaults to CWL_CONCURRENT_RUNS or the number of CPUs minus 2
+        *args, **kwargs) -> List[ Tuple[Dict, str] ]:
+        """
+        Run the CWL specified for the test case once for each of the inputs, several at a time,
+        and return the `(output_json, output_dir)` for each input in the same order as `inputs`
+
+        Each run gets its own dir inside `self.tmpdir`; `run-0`, `run-1`, etc.
+        Toil run stats are handled the same as in `run_cwl`, with the saved stats for each run named after its dir
+
+        Examples
+        --------
+        Example usage::
+
+            inputs = [ {"input_file": input1, "output_filename": "output.maf"}, {"input_file": input2, "output_filename": "output.maf"} ]
+            results = self.run_cwl_batch(inputs)
+            for output_json, output_dir in results:
+                ...
+        """
+        if cwl_file is None:
+            cwl_file = self.cwl_file
+            if not isinstance(cwl_file, CWLFile):
+                cwl_file = CWLFile(cwl_file)
+
+        # override with value passed from env var
+        if CWL_ENGINE != CWL_DEFAULT_ENGINE:
+            engine = CWL_ENGINE
+
+        if max_workers is None:
+            max_workers = CWL_CONCURRENT_RUNS or max((os.cpu_count() or 1) - 2, 1)
+
+        self._write_run_marker()
+
+        runners = []
+        for i, input in enumerate(inputs):
+            runner = CWLRunner(
+                cwl_file = cwl_file,
+                input = input,
+                verbose = False,
+                dir = os.path.join(self.tmpdir, "run-{}".format(i)),
+                testcase = self,
+                engine = engine,
+                *args, **self.runner_args, **kwargs)
+            runners.append(runner)
+
+        with CWLRunnerPool(max_workers = max_workers) as pool:
+            results = pool.run(runners)
+
+        for i, runner in enumerate(runners):
+            self._handle_toil_stats(runner, "{}.run-{}".format(self.test_label, i))
+
+        return([ (output_json, output_dir) for output_json, output_dir, output_json_file in results ])
 
     def run_command(self, *args, **kwargs) -> Tuple[int, str, str]:
         """
@@ -300,6 +461,13 @@ class PlutoTestCase(unittest.TestCase):
         filepath = write_table(*args, **kwargs)
         return(filepath)
 
+    def write_dicts(self, *args, **kwargs) -> str:
+        """
+        Wrapper around :func:`~pluto.write_dicts`
+        """
+        filepath = write_dicts(*args, **kwargs)
+        return(filepath)
+
     def read_table(self, input_file: str) -> List[ List[str] ]:
         """
         Simple loading of tabular lines in a file
@@ -314,8 +482,14 @@ class PlutoTestCase(unittest.TestCase):
         list
             a list of file lines split on whitespace
         """
+        # read the whole file at once and split it here instead of iterating over the file line by line
         with open(input_file) as fin:
-            lines = [ l.strip().split() for l in fin ]
+            data = fin.read()
+        lines = data.split('\n')
+        # the trailing newline at the end of the file does not start a new line
+        if lines[-1] == '':
+            lines.pop()
+        lines = [ l.split() for l in lines ]
         return(lines)
 
     def load_mutations(self, *args, **kwargs) -> Tuple[ List[str], List[Dict] ]:
@@ -325,6 +499,20 @@ class PlutoTestCase(unittest.TestCase):
         comments, mutations = load_mutations(*args, **kwargs)
         return(comments, mutations)
 
+    def iter_mutations(self, *args, **kwargs) -> Tuple[ List[str], Iterator[Dict] ]:
+        """
+        Wrapper around :func:`~pluto.iter_mutations`
+        """
+        comments, mutations = iter_mutations(*args, **kwargs)
+        return(comments, mutations)
+
+    def load_mutations_many(self, *args, **kwargs) -> List[ Tuple[ List[str], List[Dict] ] ]:
+        """
+        Wrapper around :func:`~pluto.load_mutations_many`
+        """
+        results = load_mutations_many(*args, **kwargs)
+        return(results)
+
     def dicts2lines(self, *args, **kwargs) -> List[ List[str] ]:
         """
         Wrapper around :func:`~pluto.dicts2lines`
@@ -360,8 +548,7 @@ class PlutoTestCase(unittest.TestCase):
         values = {}
         for filepath in filepaths:
             table_reader = TableReader(filepath)
-            records = [ rec for rec in table_reader.read() ]
-            for record in records:
+            for record in table_reader.read():
                 sample_id = record[sample_fieldname]
                 values[sample_id] = record[value_fieldname]
         return(values)
@@ -370,11 +557,14 @@ class PlutoTestCase(unittest.TestCase):
         self,
         d1: dict,
         d2: dict,
-        bad_keys = ('nameext', 'nameroot', 'streamable'), # These keys show up inconsistently in Toil CWL output so just strip them out any time we see them
+        bad_keys = None, # keys to strip out of the dicts; defaults to 'nameext', 'nameroot', 'streamable' which show up inconsistently in Toil CWL output
         related_keys = None, # mapping of key:value pairs that should trigger removal of other keys
         _print: bool = False,
         _printJSON: bool = False,
-        *args, **kwargs):
+        *args,
+        assume_disposable: bool = False, # the dicts are not used again after this so they can be cleaned in place without copying them
+        replace_paths: Dict[str, str] = None, # mapping of paths (or any substrings) to placeholders, replaced in all string values of both dicts
+        **kwargs):
         """
         Compare the JSON-style CWL output dicts
 
@@ -382,21 +572,54 @@ class PlutoTestCase(unittest.TestCase):
         `nameext` and `nameroot`
         from dicts representing CWL cwltool / Toil JSON output
         before testing them for equality
+
+        Use `assume_disposable = True` when the dicts are not needed after the comparison, e.g. a fresh `output_json` from `run_cwl`;
+        the keys will be removed from `d1` and `d2` directly instead of from copies of them
+
+        Use `replace_paths` to compare outputs that were written to different directories,
+        e.g. `replace_paths = {output_dir: '<OUTPUT>'}` on both dicts makes the 'path' and 'location' entries independent of the run dir
+
+        Examples
+        --------
+        Example usage::
+
+            output_json, output_dir = self.run_cwl()
+            self.assertCWLDictEqual(output_json, expected_output, assume_disposable = True)
+
+            self.assertCWLDictEqual(output_json1, output_json2, replace_paths = {output_dir1: '<OUTPUT>', output_dir2: '<OUTPUT>'})
         """
+        # dicts that are already equal will still be equal after removing the same keys from both,
+        # so skip cleaning them; the comparison is done in C without building any new objects
+        if isinstance(d1, dict) and isinstance(d2, dict) and d1 == d2 and not _print and not _printJSON:
+            return
+
         if related_keys is None:
             related_keys = self.related_keys
 
         # if we are running with Toil then we need to remove the 'path' key
         # because thats just what Toil does idk why
-        if CWL_ENGINE.toil:
-            bad_keys = [ *bad_keys, 'path' ]
-
-        # copy the input dicts just to be safe
-        # NOTE: this could backfire potentially, idk, watch out for big nested objects I guess
-        d1_copy = deepcopy(d1)
-        d2_copy = deepcopy(d2)
-        clean_dicts(d1_copy, bad_keys = bad_keys, related_keys = related_keys)
-        clean_dicts(d2_copy, bad_keys = bad_keys, related_keys = related_keys)
+        if bad_keys is None:
+            bad_keys = _BAD_KEYS_TOIL if CWL_ENGINE.toil else _BAD_KEYS_DEFAULT
+        elif CWL_ENGINE.toil:
+            bad_keys = frozenset(bad_keys).union(('path',))
+
+        # build the lookup table for each assertion, so that changes made to related_keys in place are always picked up;
+        # this only goes over related_keys once, the dicts are then checked against it with a single lookup per key
+        related_map = related_keys_map(related_keys)
+        if assume_disposable:
+            # clean the input dicts in place
+            clean_dicts(d1, bad_keys = bad_keys, related_map = related_map)
+            clean_dicts(d2, bad_keys = bad_keys, related_map = related_map)
+            d1_copy = d1
+            d2_copy = d2
+        else:
+            # get cleaned copies so the input dicts are left unchanged;
+            # only the parts of the dicts that have keys removed get copied
+            d1_copy = clean_dicts_copy(d1, bad_keys = bad_keys, related_map = related_map)
+            d2_copy = clean_dicts_copy(d2, bad_keys = bad_keys, related_map = related_map)
+        if replace_paths:
+            d1_copy = replace_in_strings(d1_copy, replace_paths)
+            d2_copy = replace_in_strings(d2_copy, replace_paths)
         if _print:
             print(d1_copy)
             print(d2_copy)
@@ -512,8 +735,9 @@ class PlutoTestCase(unittest.TestCase):
         """
         Assertion for the number of mutations in a file
         """
-        comments, mutations = self.load_mutations(filepath)
-        self.assertEqual(len(mutations), expected_num, *args, **kwargs)
+        comments, mutations = self.iter_mutations(filepath)
+        num_mutations = sum(1 for _ in mutations)
+        self.assertEqual(num_mutations, expected_num, *args, **kwargs)
 
     def assertEqualNumMutations(
         self,
@@ -525,13 +749,13 @@ class PlutoTestCase(unittest.TestCase):
         """
         numMuts = []
         for filepath in mutationFiles:
-            comments, mutations = self.load_mutations(filepath)
-            numMutations = len(mutations)
+            comments, mutations = self.iter_mutations(filepath)
+            numMutations = sum(1 for _ in mutations)
             numMuts.append(numMutations)
         sumMuts = sum(numMuts)
 
-        comments, expected_mutations = self.load_mutations(expectedMutFile)
-        sumExpectedMuts = len(expected_mutations)
+        comments, expected_mutations = self.iter_mutations(expectedMutFile)
+        sumExpectedMuts = sum(1 for _ in expected_mutations)
 
         self.assertEqual(sumMuts, sumExpectedMuts, *args, **kwargs)
 
@@ -547,7 +771,7 @@ class PlutoTestCase(unittest.TestCase):
         Test that the set of all values in a column of the mutation maf file contains all the desired values
         """
         wantedValuesSet = set(values)
-        comments, mutations = self.load_mutations(filepath)
+        comments, mutations = self.iter_mutations(filepath)
         allValues = set()
         for mut in mutations:
             allValues.add(mut[fieldname])
@@ -570,7 +794,7 @@ class PlutoTestCase(unittest.TestCase):
         """
         """
         unwantedValues = set(values)
-        comments, mutations = self.load_mutations(filepath)
+        comments, mutations = self.iter_mutations(filepath)
         allValues = set()
         for mut in mutations:
             allValues.add(mut[fieldname])
@@ -611,7 +835,7 @@ class PlutoTestCase(unittest.TestCase):
         """
         """
         table_reader = TableReader(filepath)
-        comments = table_reader.comment_lines # list of strings that looks like this; [ '#Header1\tHeader\n', ... ]
+        comments = table_reader.iter_comment_lines() # strings that look like this; [ '#Header1\tHeader\n', ... ]
         # fieldnames = table_reader.get_fieldnames()
         # records = [ rec for rec in table_reader.read() ]
         comment_parts = []
@@ -697,9 +921,8 @@ class PlutoTestCase(unittest.TestCase):
         Assumes samples are unique
         """
         table_reader = TableReader(filepath)
-        records = [ rec for rec in table_reader.read() ]
         values = {}
-        for record in records:
+        for record in table_reader.read():
             sample_id = record[sample_fieldname]
             values[sample_id] = record[value_fieldname]
         self.assertDictEqual(values, expected_values)
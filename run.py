@@ -1,15 +1,21 @@
 import os
 import sys
 import json
+import shlex
 import unittest
+import threading
 import subprocess as sp
-from pathlib import Path
-from typing import List, Dict, Tuple, Union
+from collections import deque
+from typing import List, Dict, Tuple, Union, Optional
 from .settings import (
     CWL_ARGS,
     TOIL_ARGS,
+    CWL_CACHE_DIR,
+    CWL_DAEMON,
 )
 from .cwlFile import CWLFile
+from .util import write_json, loads_json
+from .cwlWorker import get_worker
 
 def run_command(
     args: List[str], # a list of shell args to execute
@@ -26,11 +32,11 @@ def run_command(
         command = [ "foo.py", "arg1", "arg2" ]
         returncode, proc_stdout, proc_stderr = run_command(command, testcase = self, validate = True)
     """
-    process = sp.Popen(args, stdout = sp.PIPE, stderr = sp.PIPE, universal_newlines = True)
-    proc_stdout, proc_stderr = process.communicate()
+    # sp.run cleans up the pipes and waits on the child process even if an exception is raised
+    process = sp.run(args, capture_output = True, text = True, check = False)
     returncode = process.returncode
-    proc_stdout = proc_stdout.strip()
-    proc_stderr = proc_stderr.strip()
+    proc_stdout = process.stdout.strip()
+    proc_stderr = process.stderr.strip()
 
     if print_stdout:
         print(proc_stdout)
@@ -42,6 +48,60 @@ def run_command(
         testcase.assertEqual(returncode, 0)
     return(returncode, proc_stdout, proc_stderr)
 
+def run_command_stream(
+    args: List[str], # a list of shell args to execute
+    chunk_size: int = 1 << 16, # number of bytes of stdout to read at a time
+    stderr_lines: int = None # only keep this many lines from the end of stderr; keeps all of stderr by default
+    ) -> Tuple[int, bytes, str]:
+    """
+    Run a shell command and read its stdout as raw bytes, a chunk at a time, while stderr is read in a separate thread
+
+    Use this instead of `run_command` for commands that print a large JSON document such as the cwl-runner output;
+    the bytes can be passed straight to `loads_json` without first decoding and stripping a copy of the text
+
+    Examples
+    -------
+    Example usage::
+
+        returncode, proc_stdout, proc_stderr = run_command_stream(command)
+        output_json = loads_json(proc_stdout)
+
+        # keep only the last 100 lines of a long stderr log
+        returncode, proc_stdout, proc_stderr = run_command_stream(command, stderr_lines = 100)
+    """
+    # with stderr_lines, only the tail of a long log is held in memory for printing on errors
+    stderr_chunks: deque = deque(maxlen = stderr_lines)
+    with sp.Popen(args, stdout = sp.PIPE, stderr = sp.PIPE, bufsize = chunk_size) as process:
+        assert process.stdout is not None
+        assert process.stderr is not None
+        stderr = process.stderr
+        # read stderr at the same time so the child cannot block on a full stderr pipe
+        if stderr_lines is None:
+            read_stderr = lambda: stderr_chunks.append(stderr.read())
+        else:
+            read_stderr = lambda: stderr_chunks.extend(stderr)
+        stderr_thread = threading.Thread(target = read_stderr, daemon = True)
+        stderr_thread.start()
+        stdout_chunks = []
+        while True:
+            chunk = process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            stdout_chunks.append(chunk)
+        stderr_thread.join()
+        returncode = process.wait()
+    proc_stdout = b''.join(stdout_chunks)
+    proc_stderr = b''.join(stderr_chunks).decode(errors = 'replace').strip()
+    return(returncode, proc_stdout, proc_stderr)
+
+def _decode_stdout(proc_stdout: Union[str, bytes]) -> str:
+    """
+    Get the stdout from `run_command_stream` as text for printing
+    """
+    if isinstance(proc_stdout, bytes):
+        proc_stdout = proc_stdout.decode(errors = 'replace')
+    return(proc_stdout.strip())
+
 def run_cwl(
     tmpdir: str, # dir where execution is taking place and files are staged & written
     input_json: dict, # CWL input data
@@ -68,13 +128,15 @@ def run_cwl(
     """
     if CLI_ARGS is None:
         CLI_ARGS = CWL_ARGS
+    # copy the args once so the extra flags can be appended without modifying the caller's list
+    CLI_ARGS = list(CLI_ARGS)
 
     if not input_is_file:
         # the input_json is a Python dict that needs to be dumped to file
         if not input_json_file:
             input_json_file = os.path.join(tmpdir, "input.json")
-        with open(input_json_file, "w") as json_out:
-            json.dump(input_json, json_out, indent = 4)
+        # cwl-runner does not need the indentation; only keep it when debugging
+        write_json(input_json, input_json_file, pretty = debug)
     else:
         # input_json is a pre-existing JSON file
         input_json_file = input_json
@@ -82,23 +144,27 @@ def run_cwl(
     if output_dir is None:
         output_dir = os.path.join(tmpdir, "output")
     cache_dir = os.path.join(tmpdir, 'tmp', "cache")
+    # use the shared persistent cache dir instead, if one was set
+    if CWL_CACHE_DIR:
+        cache_dir = CWL_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok = True)
     tmp_dir = os.path.join(tmpdir, 'tmp', "tmp")
 
     if leave_outputs:
-        CLI_ARGS = [ *CLI_ARGS, '--leave-outputs' ]
+        CLI_ARGS.append('--leave-outputs')
     if leave_tmpdir:
-        CLI_ARGS = [ *CLI_ARGS, '--leave-tmpdir' ]
+        CLI_ARGS.append('--leave-tmpdir')
     if debug:
-        CLI_ARGS = [ *CLI_ARGS, '--debug' ]
+        CLI_ARGS.append('--debug')
     if parallel:
         print(">>> Running cwl-runner with 'parallel'; make sure all Singularity containers are pre-cached or it will break!")
         # if the containers are not already all pre-pulled then it can cause issues with parallel jobs all trying to pull the same container to the same filepath
-        CLI_ARGS = [ *CLI_ARGS, '--parallel' ]
+        CLI_ARGS.append('--parallel')
     if js_console:
-        CLI_ARGS = [ *CLI_ARGS, '--js-console' ]
+        CLI_ARGS.append('--js-console')
 
     if use_cache:
-        CLI_ARGS = [ *CLI_ARGS, '--cachedir', cache_dir ]
+        CLI_ARGS.extend([ '--cachedir', cache_dir ])
 
     command = [
         "cwl-runner",
@@ -110,13 +176,24 @@ def run_cwl(
         ]
     if print_command:
         print(">>> cwl-runner command:")
-        print(' '.join([ str(c) for c in  command ]) )
-
-    returncode, proc_stdout, proc_stderr = run_command(command)
+        # quote the args so the command can be copy / pasted into a shell
+        print(shlex.join([ os.fspath(c) for c in command ]))
+
+    # stdout is text when it comes from the worker and bytes when read from the subprocess
+    result: Tuple[int, Union[bytes, str], str]
+    worker_result: Optional[ Tuple[int, str, str] ] = None
+    if CWL_DAEMON:
+        # run in the shared cwltool worker process if it is not busy with another run
+        worker_result = get_worker().run(command[1:])
+    if worker_result is not None:
+        result = worker_result
+    else:
+        result = run_command_stream(command)
+    returncode, proc_stdout, proc_stderr = result
 
 
     if print_stdout:
-        print(proc_stdout)
+        print(_decode_stdout(proc_stdout))
 
     if print_stderr:
         print(proc_stderr)
@@ -127,7 +204,7 @@ def run_cwl(
     if check_returncode:
         testcase.assertEqual(returncode, 0)
 
-    output_json = json.loads(proc_stdout)
+    output_json = loads_json(proc_stdout)
     return(output_json, output_dir)
 
 def run_cwl_toil(
@@ -156,6 +233,8 @@ def run_cwl_toil(
 
     if CLI_ARGS is None:
         CLI_ARGS = TOIL_ARGS
+    # copy the args once so the extra flags can be appended without modifying the caller's list
+    CLI_ARGS = list(CLI_ARGS)
 
     # if we are not restarting, jobStore should not already exist
     if not restart:
@@ -164,7 +243,7 @@ def run_cwl_toil(
         if os.path.exists(jobStore):
             print(">>> ERROR: Job store already exists; ", jobStore)
             sys.exit(1)
-        CLI_ARGS = [ *CLI_ARGS, '--jobStore', jobStore ]
+        CLI_ARGS.extend([ '--jobStore', jobStore ])
 
     # if we are restarting, jobStore needs to exist
     else:
@@ -177,16 +256,15 @@ def run_cwl_toil(
             print(">>> ERROR: jobStore does not exist; ", jobStore)
             sys.exit(1)
         # need to add extra restart args
-        CLI_ARGS = [ *CLI_ARGS, '--restart', '--jobStore', jobStore ]
+        CLI_ARGS.extend([ '--restart', '--jobStore', jobStore ])
 
     if not input_is_file:
         # the input_data is a Python dict to be dumped to JSON file
         # if there is already a desired path to dump input data to
         if input_json_file is None:
             input_json_file = os.path.join(run_dir, "input.json")
-        # dump input data to JSON file
-        with open(input_json_file, "w") as json_out:
-            json.dump(input_data, json_out, indent = 4)
+        # dump input data to JSON file; Toil does not need the indentation
+        write_json(input_data, input_json_file, pretty = False)
     else:
         # input_json is a pre-existing JSON file
         input_json_file = input_data
@@ -208,8 +286,8 @@ def run_cwl_toil(
     # /run-1/tmp/tmpabcxyz
     tmpDirPrefix = os.path.join(tmpDir, "tmp")
 
-    Path(workDir).mkdir(parents=True, exist_ok=True)
-    Path(tmpDir).mkdir(parents=True, exist_ok=True)
+    os.makedirs(workDir, exist_ok = True)
+    os.makedirs(tmpDir, exist_ok = True)
 
     command = [
         "toil-cwl-runner",
@@ -224,12 +302,13 @@ def run_cwl_toil(
 
     if print_command:
         print(">>> toil-cwl-runner command:")
-        print(' '.join([ str(c) for c in  command ]) )
+        # quote the args so the command can be copy / pasted into a shell
+        print(shlex.join([ os.fspath(c) for c in command ]))
 
-    returncode, proc_stdout, proc_stderr = run_command(args = command)
+    returncode, proc_stdout, proc_stderr = run_command_stream(args = command)
 
     if print_stdout:
-        print(proc_stdout)
+        print(_decode_stdout(proc_stdout))
 
     if print_stderr:
         print(proc_stderr)
@@ -241,11 +320,11 @@ def run_cwl_toil(
         testcase.assertEqual(returncode, 0)
 
     try:
-        output_data = json.loads(proc_stdout)
+        output_data = loads_json(proc_stdout)
         return(output_data, output_dir, jobStore)
 
     # if you cant decode the JSON stdout then it did not finish correctly
     except json.decoder.JSONDecodeError:
-        print(proc_stdout)
+        print(_decode_stdout(proc_stdout))
         print(proc_stderr)
         raise
@@ -57,7 +57,7 @@ from __future__ import annotations # python 3.7-3.9, not needed in 3.10
 import os
 import sys
 import json
-from copy import deepcopy
+from copy import copy
 from typing import List, Dict
 from urllib.parse import urlparse, urlsplit, urlunsplit
 
@@ -272,7 +272,10 @@ class ODir(dict):
         updates the 'listing' for all sub-items as well in order to pre-pend the correct base_path to all 'path' and 'location' fields
         """
         for item in items:
-            i = deepcopy(item) # need a copy because we are dealing with mutable objects; WARNING: this could have bad memory implications for some massive object but we usually dont see that in test cases...
+            # need a copy because we are dealing with mutable objects;
+            # a shallow copy is enough since only 'path', 'location', and 'listing' get replaced on the copy,
+            # and the nested 'listing' items get copied by the recursive call below
+            i = copy(item)
             i.path = os.path.join(base_path, i.path)
             i.location = location_base + i.path
             if 'path' in i.keys():
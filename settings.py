@@ -7,6 +7,8 @@ PRINT_COMMAND=true KEEP_TMP=true CWL_ENGINE=toil LARGE_TESTS=true python3 test_t
 
 """
 import os
+import warnings
+from typing import Optional
 from .classes import (
     CWLEngine,
     UseLSF,
@@ -18,7 +20,9 @@ from .classes import (
     SuppressStartupMessages,
     ToilStats,
     PrintToilStats,
-    SaveToilStats
+    SaveToilStats,
+    CWLParallel,
+    CWLDaemon
     )
 
 quiet_mode = SuppressStartupMessages(os.environ.get('QUIET', "False"))
@@ -81,6 +85,30 @@ if not STATS_DIR:
 if PRINT_STATS or SAVE_STATS:
     TOIL_STATS.value = True
 
+# persistent cache dir for cwltool to re-use step outputs across test runs instead of re-running them;
+# by default each run gets its own cache dir inside its tmpdir which gets deleted afterwards
+# NOTE: this dir is never cleaned up automatically and will keep growing, delete it periodically
+CWL_CACHE_DIR = os.environ.get("CWL_CACHE_DIR", None)
+
+# run the jobs in each cwltool workflow in parallel
+# NOTE: make sure all Singularity containers are pre-cached first or parallel jobs will break trying to pull the same container
+CWL_PARALLEL = CWLParallel(os.environ.get('CWL_PARALLEL', "False"))
+
+# run cwltool inside a long-lived worker process instead of starting a new cwl-runner process for every run,
+# so that cwltool only needs to be imported once; requires cwltool to be importable in this Python environment
+CWL_DAEMON = CWLDaemon(os.environ.get('CWL_DAEMON', "False"))
+
+# max number of CWL runs to have going at the same time in PlutoTestCase.run_cwl_batch;
+# set to 1 to run the batch one at a time, defaults to the number of CPUs minus 2
+_concurrent_runs = os.environ.get('CWL_CONCURRENT_RUNS', "")
+CWL_CONCURRENT_RUNS: Optional[int] = None
+if _concurrent_runs:
+    try:
+        CWL_CONCURRENT_RUNS = max(int(_concurrent_runs), 1)
+    except ValueError:
+        # dont break every import of the package over a bad value; the default gets used instead
+        warnings.warn("Ignoring invalid CWL_CONCURRENT_RUNS value {}; it should be a whole number".format(repr(_concurrent_runs)))
+
 # common args to be included in all cwltool invocations
 CWL_ARGS = [
     "--preserve-environment", "PATH",
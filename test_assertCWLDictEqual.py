@@ -141,3 +141,49 @@ class TestAssertCWLDictEqual(PlutoTestCase):
             ]
         self.assertCWLDictEqual(_dir, expected, related_keys = related_keys)
 
+
+class TestAssertCWLDictEqualClassRelatedKeys(PlutoTestCase):
+    # related_keys set on the class get used by default
+    related_keys = [
+        ('basename', "report1.html", ['size', 'checksum'])
+        ]
+
+    def test_class_related_keys(self):
+        """
+        Test that related_keys set on a subclass are used by assertCWLDictEqual
+        """
+        d1 = {'output_file': {'basename': 'report1.html', 'class': 'File', 'size': 1, 'checksum': 'sha1$foo1'}}
+        d2 = {'output_file': {'basename': 'report1.html', 'class': 'File', 'size': 2, 'checksum': 'sha1$foo2'}}
+        self.assertCWLDictEqual(d1, d2)
+
+        # custom related_keys for the instance are used instead of the class ones
+        self.related_keys = []
+        with self.assertRaises(AssertionError):
+            self.assertCWLDictEqual(d1, d2)
+
+    def test_class_related_keys_changed_in_place(self):
+        """
+        Test that changes made in place to the class related_keys are used by assertCWLDictEqual
+        """
+        class RelatedKeysTestCase(PlutoTestCase):
+            related_keys = [
+                ('basename', "report1.html", ['size'])
+                ]
+            def runTest(self):
+                pass
+        tc = RelatedKeysTestCase()
+        d1 = {'output_file': {'basename': 'report2.html', 'class': 'File', 'size': 1}}
+        d2 = {'output_file': {'basename': 'report2.html', 'class': 'File', 'size': 2}}
+        with self.assertRaises(AssertionError):
+            tc.assertCWLDictEqual(d1, d2)
+
+        tc.related_keys.append(('basename', "report2.html", ['size']))
+        tc.assertCWLDictEqual(d1, d2)
+
+        # changes to the lists of keys to remove are picked up too
+        d1['output_file']['checksum'] = 'sha1$foo1'
+        d2['output_file']['checksum'] = 'sha1$foo2'
+        with self.assertRaises(AssertionError):
+            tc.assertCWLDictEqual(d1, d2)
+        tc.related_keys[1][2].append('checksum')
+        tc.assertCWLDictEqual(d1, d2)
@@ -5,9 +5,11 @@ test cases for tools.clean_dicts, which is the core scrubbing logic behind asser
 which makes up the most important CWL validation methods in the pluto module
 """
 import os
+import json
 from . import (
         PlutoTestCase,
-        clean_dicts
+        clean_dicts,
+        clean_dicts_copy
     )
 
 class TestCleanDicts(PlutoTestCase):
@@ -132,3 +134,71 @@ class TestCleanDicts(PlutoTestCase):
         clean_dicts(d, related_keys = related_keys)
         self.maxDiff = None
         self.assertDictEqual(d, expected)
+
+    def test_clean_related_keys_same_key(self):
+        """
+        Multiple related_keys entries for the same key:value pair should all be applied,
+        and keys with unhashable values should not break the matching
+        """
+        d = {'basename': "report.html", "class": "File", 'size': "1", "checksum": "foobar", "secondaryFiles": []}
+        related_keys = [
+            ('basename', "report.html", ['size']),
+            ('basename', "report.html", ['checksum']),
+            ('secondaryFiles', "report.html", ['class'])
+            ]
+        expected = {'basename': "report.html", "class": "File", "secondaryFiles": []}
+        clean_dicts(d, related_keys = related_keys)
+        self.assertDictEqual(d, expected)
+
+    def test_clean_dicts_copy(self):
+        """
+        clean_dicts_copy should give the same result as clean_dicts without changing the original object,
+        and share the parts of the object that did not need to be cleaned
+        """
+        d = {
+        "output_dir": {
+            "class": "Directory",
+            "basename": "output",
+            "listing":[
+                {"class": "File", "basename": "report.html", "size": "1", "checksum": "foobarhash"},
+                {"class": "File", "basename": "samples.txt", "size": "2", "checksum": "foobarhash2"}
+                ]
+            },
+        "mutations_file": {
+            "class": "File", "basename": "mutations.txt", "size": "4", 'nameext': ".txt", 'nameroot':'mutations'
+            },
+        "other_files": [
+            {"class": "File", "basename": "foo.txt", "size": "5"}
+            ]
+        }
+        related_keys = [('basename', "report.html", ['size', 'checksum'])]
+        original = json.loads(json.dumps(d))
+
+        d_clean = clean_dicts_copy(d, related_keys = related_keys)
+        self.assertDictEqual(d, original)
+
+        clean_dicts(original, related_keys = related_keys)
+        self.assertDictEqual(d_clean, original)
+
+        self.assertTrue(d_clean["other_files"] is d["other_files"])
+        self.assertTrue(d_clean["output_dir"]["listing"][1] is d["output_dir"]["listing"][1])
+        self.assertFalse(d_clean["output_dir"] is d["output_dir"])
+
+        # nothing to clean gives back the same object
+        d = {'a': [1, {'b': 2}]}
+        self.assertTrue(clean_dicts_copy(d) is d)
+
+    def test_clean_deeply_nested(self):
+        """
+        Very deeply nested objects should not hit the recursion limit
+        """
+        d = {'a': 1, 'nameext': "foo"}
+        inner = d
+        for _ in range(5000):
+            inner['b'] = [{'nameroot': "bar"}]
+            inner = inner['b'][0]
+        clean_dicts(d)
+        self.assertEqual(d['a'], 1)
+        self.assertTrue('nameext' not in d)
+        # the innermost dict
+        self.assertDictEqual(inner, {})
@@ -139,6 +139,18 @@ class TestSerializer(PlutoTestCase):
         self.maxDiff = None
         self.assertDictEqual(_dir, expected)
 
+    def test_cwl_dir_items_unchanged(self):
+        """
+        Test that the items passed to ODir do not get their paths changed
+        """
+        _file = OFile(size = 488, name = 'Sample4_purity.seg', hash = 'e6df130c57ca594578f9658e589cfafc8f40a56c')
+        _subdir = ODir(name = 'foo', items = [_file])
+        _dir = ODir(name = 'portal', dir = self.tmpdir, items = [_subdir])
+        self.assertEqual(_file['path'], 'Sample4_purity.seg')
+        self.assertEqual(_subdir['path'], 'foo')
+        self.assertEqual(_subdir['listing'][0]['path'], 'foo/Sample4_purity.seg')
+        self.assertEqual(_dir['listing'][0]['listing'][0]['path'], os.path.join(self.tmpdir, 'portal/foo/Sample4_purity.seg'))
+
 
 # The next test cases are going to run an actual CWL to test against their results
 has_cwl_runner = True if shutil.which('cwl-runner') else False
@@ -4,14 +4,25 @@
 unit tests for table IO handling methods from the tools module
 """
 import os
+import csv
 import gzip
+import unittest
+from . import util
 from . import (
         md5_file,
         PlutoTestCase,
         TableReader,
         write_table,
         load_mutations,
+        iter_mutations,
+        load_mutations_rows,
+        load_mutations_np,
+        load_mutations_arrow,
+        load_mutations_many,
         dicts2lines,
+        write_dicts,
+        rows2dicts,
+        open_gzip,
         MafWriter
     )
 
@@ -48,6 +59,17 @@ class TestTableHandlers(PlutoTestCase):
         hash = md5_file(input_path)
         self.assertEqual(hash, '584d00e49b0bd7f963af1db46a61d2f0')
 
+    def test_write_many_lines(self):
+        """
+        Make sure that tables with more lines than are written at once still get written out completely
+        """
+        lines = [ ['Hugo_Symbol', 't_depth'] ] + [ ['SUFU', str(i)] for i in range(10000) ]
+        input_path = write_table(tmpdir = self.tmpdir, filename = 'input.maf', lines = (line for line in lines))
+        with open(input_path) as f:
+            output_lines = [ l for l in f ]
+        expected_lines = [ '\t'.join(line) + '\n' for line in lines ]
+        self.assertEqual(output_lines, expected_lines)
+
     def test_TableReader1(self):
         """
         Test that table is read correctly
@@ -158,7 +180,120 @@ class TestTableHandlers(PlutoTestCase):
             ]
         self.assertEqual(records, expected_records)
 
+    def test_TableReader_count(self):
+        """
+        Test that the number of records in the table is counted correctly
+        """
+        maf_lines = [
+        '# comment 1\n',
+        '# comment 2\n',
+        'Hugo_Symbol\tt_depth\tt_alt_count\n',
+        'SUFU\t100\t75\n',
+        'GOT1\t100\t1\n',
+        'SOX9\t100\t0\n'
+        ]
+        input_maf_file = os.path.join(self.tmpdir, "data.txt")
+        with open(input_maf_file, "w") as fout:
+            for line in maf_lines:
+                fout.write(line)
+
+        table_reader = TableReader(input_maf_file)
+        self.assertEqual(table_reader.count(), 3)
+
+        # file without a trailing newline on the last line
+        input_maf_file = os.path.join(self.tmpdir, "data_no_newline.txt")
+        with open(input_maf_file, "w") as fout:
+            for line in maf_lines:
+                fout.write(line)
+            fout.write('BRCA\t100\t5')
+
+        table_reader = TableReader(input_maf_file)
+        self.assertEqual(table_reader.count(), 4)
+
+        # file with only a header
+        input_maf_file = os.path.join(self.tmpdir, "data_header_only.txt")
+        with open(input_maf_file, "w") as fout:
+            fout.write('Hugo_Symbol\tt_depth\tt_alt_count\n')
+
+        table_reader = TableReader(input_maf_file)
+        self.assertEqual(table_reader.count(), 0)
+
+        # blank lines are not records, same as when reading the table
+        input_maf_file = os.path.join(self.tmpdir, "data_blank_lines.txt")
+        with open(input_maf_file, "w") as fout:
+            fout.write('# comment 1\nHugo_Symbol\tt_depth\n\nSUFU\t100\n\n\r\nGOT1\t100\r\n\n')
 
+        table_reader = TableReader(input_maf_file)
+        self.assertEqual(table_reader.count(), 2)
+        self.assertEqual(table_reader.count(), len(list(table_reader.read())))
+
+    def test_TableReader_reuse(self):
+        """
+        Test that the header is only parsed once and the records can be read repeatedly
+        """
+        maf_lines = [
+        '# comment 1\n',
+        '# comment 2\n',
+        'Hugo_Symbol\tt_depth\n',
+        'SUFU\t100\n',
+        'GOT1\t100\n'
+        ]
+        input_maf_file = os.path.join(self.tmpdir, "data.txt")
+        with open(input_maf_file, "w") as fout:
+            fout.writelines(maf_lines)
+
+        table_reader = TableReader(input_maf_file)
+        expected_records = [
+            {'Hugo_Symbol': 'SUFU', 't_depth': '100'},
+            {'Hugo_Symbol': 'GOT1', 't_depth': '100'}
+            ]
+        self.assertEqual([ rec for rec in table_reader.read() ], expected_records)
+        self.assertEqual([ rec for rec in table_reader.read() ], expected_records)
+
+        with open(input_maf_file) as fin:
+            reader = table_reader.get_reader(fin)
+            self.assertEqual([ rec for rec in reader ], expected_records)
+
+        # comment_lines is built once and can be replaced
+        self.assertTrue(table_reader.comment_lines is table_reader.comment_lines)
+        table_reader.comment_lines = ['# new comment\n']
+        self.assertEqual(table_reader.comment_lines, ['# new comment\n'])
+
+        # fieldnames were cached when the table was first opened
+        os.remove(input_maf_file)
+        self.assertEqual(table_reader.get_fieldnames(), ['Hugo_Symbol', 't_depth'])
+
+    def test_TableReader_read_columns(self):
+        """
+        Test that only the requested columns are returned for each record
+        """
+        maf_lines = [
+        '# comment 1\n',
+        'Hugo_Symbol\tt_depth\tt_alt_count\n',
+        'SUFU\t100\t75\n',
+        'GOT1\t100\n'
+        ]
+        input_maf_file = os.path.join(self.tmpdir, "data.txt")
+        with open(input_maf_file, "w") as fout:
+            fout.writelines(maf_lines)
+
+        table_reader = TableReader(input_maf_file)
+        records = [ rec for rec in table_reader.read_columns(['t_alt_count', 'Hugo_Symbol']) ]
+        expected_records = [
+            {'t_alt_count': '75', 'Hugo_Symbol': 'SUFU'},
+            {'t_alt_count': None, 'Hugo_Symbol': 'GOT1'}
+            ]
+        self.assertEqual(records, expected_records)
+
+        records = [ rec for rec in table_reader.read_columns(['t_depth']) ]
+        self.assertEqual(records, [{'t_depth': '100'}, {'t_depth': '100'}])
+
+        # no columns selected gives an empty record for each row
+        records = [ rec for rec in table_reader.read_columns([]) ]
+        self.assertEqual(records, [{}, {}])
+
+        with self.assertRaises(ValueError):
+            [ rec for rec in table_reader.read_columns(['foo']) ]
 
     def test_load_mutations1(self):
         """
@@ -192,6 +327,187 @@ class TestTableHandlers(PlutoTestCase):
             ]
         self.assertEqual(mutations, expected_mutations)
 
+    def test_load_mutations_generator(self):
+        """
+        Make sure that mutations can be loaded lazily from a maf file
+        """
+        lines = [
+            ['# comment 1'],
+            ['Hugo_Symbol', 't_depth', 'Consequence'],
+            ['SUFU', '100', 'missense_variant'],
+            ['GOT1', '100', 'synonymous_variant'],
+        ]
+        input_maf_file = write_table(tmpdir = self.tmpdir, filename = 'input.maf', lines = lines)
+
+        comments, mutations = iter_mutations(input_maf_file, strip = True)
+        self.assertEqual(comments, ['# comment 1'])
+        self.assertFalse(isinstance(mutations, list))
+
+        expected_mutations = [
+            {'Hugo_Symbol': 'SUFU', 't_depth': '100'},
+            {'Hugo_Symbol': 'GOT1', 't_depth': '100'}
+            ]
+        self.assertEqual([ mut for mut in mutations ], expected_mutations)
+
+        # same result when loaded all at once
+        comments, mutations = load_mutations(input_maf_file, strip = True)
+        self.assertEqual(mutations, expected_mutations)
+
+        comments, mutations = iter_mutations(input_maf_file, strip = True, as_records = True)
+        self.assertEqual([ mut._asdict() for mut in mutations ], expected_mutations)
+
+        # the file is not opened for the mutations until the generator is used
+        comments, mutations = iter_mutations(input_maf_file)
+        os.remove(input_maf_file)
+        with self.assertRaises(FileNotFoundError):
+            next(mutations)
+
+    def test_load_mutations_records(self):
+        """
+        Test that mutations can be loaded as namedtuple records
+        """
+        lines = [
+            ['# comment 1'],
+            ['Hugo_Symbol', 't_depth', 'Consequence', '1000G_AF'],
+            ['SUFU', '100', 'missense_variant', '0.1'],
+            ['GOT1', '100'],
+        ]
+        input_maf_file = write_table(tmpdir = self.tmpdir, filename = 'input.maf', lines = lines)
+
+        comments, mutations = load_mutations(input_maf_file, strip = True, as_records = True)
+        self.assertEqual(comments, ['# comment 1'])
+        self.assertEqual(mutations, [('SUFU', '100', '0.1'), ('GOT1', '100', None)])
+        self.assertEqual(mutations[0].Hugo_Symbol, 'SUFU')
+        # invalid identifiers get renamed
+        self.assertEqual(mutations[0]._fields, ('Hugo_Symbol', 't_depth', '_2'))
+        self.assertEqual(mutations[1]._asdict(), {'Hugo_Symbol': 'GOT1', 't_depth': '100', '_2': None})
+
+    def test_load_mutations_many(self):
+        """
+        Test that mutations can be loaded from several files at once
+        """
+        filenames = []
+        for i in range(5):
+            lines = [
+                ['# comment {}'.format(i)],
+                ['Hugo_Symbol', 't_depth', 'Consequence'],
+                ['SUFU', str(i), 'missense_variant'],
+            ]
+            filenames.append(write_table(tmpdir = self.tmpdir, filename = 'input{}.maf'.format(i), lines = lines))
+
+        results = load_mutations_many(filenames, strip = True)
+        expected = [ (['# comment {}'.format(i)], [{'Hugo_Symbol': 'SUFU', 't_depth': str(i)}]) for i in range(5) ]
+        self.assertEqual(results, expected)
+        self.assertEqual(self.load_mutations_many(filenames[:1], strip = True), expected[:1])
+
+        # positional args go to load_mutations instead of max_workers
+        results = load_mutations_many(filenames, True, max_workers = 2)
+        self.assertEqual(results, expected)
+
+    def test_load_mutations_rows(self):
+        """
+        Test that mutations can be loaded as lists of values
+        """
+        lines = [
+            ['# comment 1'],
+            ['Hugo_Symbol', 't_depth', 'Consequence'],
+            ['SUFU', '100', 'missense_variant'],
+            [],
+            ['GOT1', '100'],
+        ]
+        input_maf_file = write_table(tmpdir = self.tmpdir, filename = 'input.maf', lines = lines)
+
+        comments, header, rows = load_mutations_rows(input_maf_file)
+        self.assertEqual(comments, ['# comment 1'])
+        self.assertEqual(header, ['Hugo_Symbol', 't_depth', 'Consequence'])
+        self.assertEqual(rows, [['SUFU', '100', 'missense_variant'], ['GOT1', '100']])
+
+        comments, header, rows = load_mutations_rows(input_maf_file, columns = ['Consequence', 'Hugo_Symbol'])
+        self.assertEqual(header, ['Consequence', 'Hugo_Symbol'])
+        self.assertEqual(rows, [['missense_variant', 'SUFU'], [None, 'GOT1']])
+
+        comments, header, rows = load_mutations_rows(input_maf_file, strip = True)
+        self.assertEqual(header, ['Hugo_Symbol', 't_depth'])
+        self.assertEqual(rows, [['SUFU', '100'], ['GOT1', '100']])
+
+    def test_load_mutations_np(self):
+        """
+        Test that mutations can be loaded into a NumPy structured array
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise unittest.SkipTest("numpy is not installed")
+        lines = [
+            ['# comment 1'],
+            ['Hugo_Symbol', 't_depth', 'Consequence'],
+            ['SUFU', '100', 'missense_variant'],
+            ['GOT1', '100'],
+        ]
+        input_maf_file = write_table(tmpdir = self.tmpdir, filename = 'input.maf', lines = lines)
+
+        comments, mutations = load_mutations_np(input_maf_file)
+        self.assertEqual(comments, ['# comment 1'])
+        self.assertEqual(mutations.dtype.names, ('Hugo_Symbol', 't_depth', 'Consequence'))
+        self.assertEqual(mutations['Hugo_Symbol'].tolist(), ['SUFU', 'GOT1'])
+        self.assertEqual(mutations['Consequence'].tolist(), ['missense_variant', ''])
+        self.assertEqual(int((mutations['t_depth'] == '100').sum()), 2)
+
+    def test_load_mutations_arrow(self):
+        """
+        Test that mutations can be loaded into a pyarrow Table
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise unittest.SkipTest("pyarrow is not installed")
+        lines = [
+            ['# comment 1'],
+            ['Hugo_Symbol', 't_depth', 'Consequence'],
+            ['SUFU', '100', 'missense_variant'],
+            ['GOT1', '100', ''],
+        ]
+        input_maf_file = write_table(tmpdir = self.tmpdir, filename = 'input.maf', lines = lines)
+
+        comments, mutations = load_mutations_arrow(input_maf_file)
+        self.assertEqual(comments, ['# comment 1'])
+        self.assertEqual(mutations.column_names, ['Hugo_Symbol', 't_depth', 'Consequence'])
+        self.assertEqual(mutations.to_pylist(), load_mutations(input_maf_file)[1])
+
+        comments, mutations = load_mutations_arrow(input_maf_file, columns = ['t_depth'])
+        self.assertEqual(mutations.to_pylist(), [{'t_depth': '100'}, {'t_depth': '100'}])
+
+        comments, mutations = load_mutations_arrow(input_maf_file, strip = True)
+        self.assertEqual(mutations.to_pylist(), load_mutations(input_maf_file, strip = True)[1])
+
+        # rows with missing values are not padded like they are by load_mutations
+        lines.append(['SOX9', '100'])
+        input_maf_file = write_table(tmpdir = self.tmpdir, filename = 'input_short_row.maf', lines = lines)
+        with self.assertRaises(pyarrow.lib.ArrowInvalid):
+            load_mutations_arrow(input_maf_file)
+
+    def test_rows2dicts(self):
+        """
+        Make sure that rows are converted to dicts the same way as csv.DictReader
+        """
+        lines = [
+            'a\tb\tc\n',
+            '1\t2\t3\n',
+            '\n', # blank line
+            '4\t5\n', # missing value
+            '6\t7\t8\t9\n' # extra value
+        ]
+        fieldnames = ['a', 'b', 'c']
+        reader = csv.reader(lines[1:], delimiter = '\t')
+        records = [ r for r in rows2dicts(reader, fieldnames) ]
+        expected_records = [ r for r in csv.DictReader(lines, delimiter = '\t') ]
+        self.assertEqual(records, expected_records)
+        self.assertEqual(records, [
+            {'a': '1', 'b': '2', 'c': '3'},
+            {'a': '4', 'b': '5', 'c': None},
+            {'a': '6', 'b': '7', 'c': '8', None: ['9']}
+        ])
+
     def test_dicts2lines(self):
         """
         Make sure that a list of dicts are converted to a list of lines correctly for writing with write_table
@@ -225,6 +541,30 @@ class TestTableHandlers(PlutoTestCase):
 
         self.assertEqual(hash, '7180052ec5b7f215a8c0eb263b474618')
 
+        # dicts with keys in a different order or missing keys still line up with the fieldnames
+        row3 = { 'b':'9', 'a':'8' }
+        row4 = { 'c':'5' }
+        lines = dicts2lines(dict_list = [row1, row3, row4])
+        self.assertEqual(lines, [['a', 'b', 'c'], ['1', '2', ''], ['8', '9', ''], ['', '', '5']])
+
+    def test_write_dicts(self):
+        """
+        Make sure that a list of dicts written directly to a table matches the output from dicts2lines and write_table
+        """
+        comments = [['# comment 1'], ['# comment 2']]
+        row1 = { 'a':'1', 'b':'2' }
+        row2 = { 'a':'6', 'b':'7' }
+
+        input_path = write_dicts(tmpdir = self.tmpdir, filename = 'input.maf', dict_list = [row1, row2], comment_list = comments)
+        self.assertEqual(md5_file(input_path), '7180052ec5b7f215a8c0eb263b474618')
+
+        # missing values are left empty, and a generator can be used with fieldnames
+        rows = ( row for row in [ {'a': '1'}, {'b': '7', 'a': '6'} ] )
+        input_path = write_dicts(tmpdir = self.tmpdir, filename = 'input2.maf', dict_list = rows, fieldnames = ['a', 'b'])
+        with open(input_path) as f:
+            lines = [ l for l in f ]
+        self.assertEqual(lines, ['a\tb\n', '1\t\n', '6\t7\n'])
+
 
 class TestGzIO(PlutoTestCase):
     """
@@ -266,6 +606,70 @@ class TestGzIO(PlutoTestCase):
         self.assertEqual(mutations, expected_mutations)
 
 
+    def test_TableReader_gz(self):
+        """
+        Test that .gz tables can be read with TableReader
+        """
+        gz_file = os.path.join(self.tmpdir, "data.tsv.gz")
+        with gzip.open(gz_file, "wt") as fout:
+            fout.write('# comment 1\n# comment 2\nHugo_Symbol\tt_depth\nSUFU\t100\nGOT1\t100\n')
+
+        table_reader = TableReader(gz_file)
+        self.assertEqual(table_reader.comment_lines, ['# comment 1\n', '# comment 2\n'])
+        self.assertEqual(table_reader.get_fieldnames(), ['Hugo_Symbol', 't_depth'])
+        self.assertEqual(table_reader.count(), 2)
+
+        expected_records = [
+            {'Hugo_Symbol': 'SUFU', 't_depth': '100'},
+            {'Hugo_Symbol': 'GOT1', 't_depth': '100'}
+            ]
+        self.assertEqual([ rec for rec in table_reader.read() ], expected_records)
+
+        # records can be read more than once
+        with table_reader.open() as fin:
+            reader = table_reader.get_reader(fin)
+            self.assertEqual([ rec for rec in reader ], expected_records)
+
+    @unittest.skipUnless(util._get_rapidgzip(), "rapidgzip is not installed")
+    def test_TableReader_rapidgzip(self):
+        """
+        Test that .gz tables read with rapidgzip give the same results as with the gzip module
+        """
+        gz_file = os.path.join(self.tmpdir, "data.tsv.gz")
+        with gzip.open(gz_file, "wt") as fout:
+            fout.write('# comment 1\n# comment 2\nHugo_Symbol\tt_depth\n')
+            for i in range(1000):
+                fout.write('SUFU\t{}\n'.format(i))
+
+        def read_table():
+            table_reader = TableReader(gz_file)
+            with table_reader.open() as fin:
+                records = [ rec for rec in table_reader.get_reader(fin) ]
+            return(
+                table_reader.comment_lines,
+                table_reader.get_fieldnames(),
+                table_reader.count(),
+                [ rec for rec in table_reader.read() ],
+                [ rec for rec in table_reader.read_columns(['t_depth']) ],
+                records
+                )
+
+        # small files are read with the gzip module
+        with open_gzip(gz_file) as fin:
+            self.assertTrue(isinstance(fin, gzip.GzipFile) or isinstance(fin.buffer, gzip.GzipFile))
+        expected = read_table()
+        self.assertEqual(expected[2], 1000)
+
+        min_size = util._RAPIDGZIP_MIN_SIZE
+        util._RAPIDGZIP_MIN_SIZE = 0
+        try:
+            with open_gzip(gz_file) as fin:
+                self.assertFalse(isinstance(fin.buffer, gzip.GzipFile))
+            self.assertEqual(read_table(), expected)
+        finally:
+            util._RAPIDGZIP_MIN_SIZE = min_size
+
+
 class TestMafWriter(PlutoTestCase):
     def test_MafWriter1(self):
         """
@@ -304,3 +708,14 @@ class TestMafWriter(PlutoTestCase):
         hash = md5_file(output_file)
         self.assertEqual(hash, '584d00e49b0bd7f963af1db46a61d2f0')
 
+        # write out another copy without building the list of comments
+        output_file = os.path.join(self.tmpdir, "output2.txt")
+        with open(output_file, "w") as fout:
+            writer = MafWriter(fout, fieldnames = fieldnames, comments = reader.iter_comment_lines())
+            writer.writeheader()
+            for row in reader.read():
+                writer.writerow(row)
+
+        hash = md5_file(output_file)
+        self.assertEqual(hash, '584d00e49b0bd7f963af1db46a61d2f0')
+
@@ -4,12 +4,28 @@
 unit tests for the tools module
 """
 import os
+import sys
+import json
+import hashlib
 import shutil
+import unittest
+from .cwlFile import _resolve_cwl_path
+from .settings import KEEP_TMP
 from . import (
     md5_file,
+    md5_files,
+    hash_file,
+    file_digests,
     md5_obj,
+    write_json,
+    loads_json,
+    write_ndjson,
+    read_ndjson,
+    run_command_stream,
     PlutoTestCase,
     CWLFile,
+    CWLRunnerPool,
+    CWLWorker,
     write_table,
     load_mutations
 )
@@ -27,6 +43,49 @@ class TestMd5(PlutoTestCase):
         hash = md5_file(filename)
         self.assertEqual(hash, 'f47c75614087a8dd938ba4acff252494')
 
+    def test_md5_files(self):
+        """
+        Test case for getting the md5 of several files at once
+        """
+        filenames = []
+        for i in range(5):
+            filename = os.path.join(self.tmpdir, "file{}.txt".format(i))
+            with open(filename, "w") as fout:
+                fout.write('foo\n' * i)
+            filenames.append(filename)
+        hashes = md5_files(filenames, max_workers = 2)
+        self.assertEqual(list(hashes.keys()), filenames)
+        self.assertEqual(hashes, { filename: md5_file(filename) for filename in filenames })
+        self.assertEqual(md5_files(filenames[:1]), { filenames[0]: md5_file(filenames[0]) })
+
+    def test_hash_file(self):
+        """
+        Test case for getting the hash of a file with other algorithms
+        """
+        filename = os.path.join(self.tmpdir, "file.txt")
+        with open(filename, "w") as fout:
+            fout.write('foo\nbar\n')
+        self.assertEqual(hash_file(filename, 'md5'), md5_file(filename))
+        self.assertEqual(hash_file(filename), hashlib.blake2b(b'foo\nbar\n').hexdigest())
+        self.assertEqual(hash_file(filename, 'sha1'), file_digests(filename)['sha1'])
+
+    def test_file_digests(self):
+        """
+        Test case for getting several hashes of a file at once
+        """
+        filename = os.path.join(self.tmpdir, "file.txt")
+        lines = ['foo', 'bar']
+        with open(filename, "w") as fout:
+            for line in lines:
+                fout.write(line + '\n')
+        digests = file_digests(filename)
+        expected = {
+            'md5': 'f47c75614087a8dd938ba4acff252494',
+            'sha1': '4e48e2c9a3d2ca8a708cb0cc545700544efb5021'
+        }
+        self.assertEqual(digests, expected)
+        self.assertEqual(digests['md5'], md5_file(filename))
+
     def test_md5_obj(self):
         """
         Test case for getting the md5 of a Python object
@@ -39,7 +98,174 @@ class TestMd5(PlutoTestCase):
         expected_hash = 'fc7c5bd4a1aa9114edb7a2a74175b9e9'
         self.assertEqual(hash, expected_hash)
 
+        # streaming the JSON gives the same hash, even when it spans several chunks
+        self.assertEqual(md5_obj(obj, stream = True), expected_hash)
+        self.assertEqual(md5_obj(obj, stream = True, chunk_size = 4), expected_hash)
+
+        # memoized hashes are the same as the regular ones
+        self.assertEqual(md5_obj(obj, memoize = True), expected_hash)
+        self.assertEqual(md5_obj(obj, memoize = True), expected_hash)
+        other_obj = obj + [{}]
+        self.assertEqual(md5_obj(other_obj, memoize = True), md5_obj(other_obj))
+
+        # memoizing from several threads at once fills the cache past its size limit without errors
+        from concurrent.futures import ThreadPoolExecutor
+        objs = [ [i] for i in range(500) ]
+        with ThreadPoolExecutor(max_workers = 8) as executor:
+            hashes = list(executor.map(lambda o: md5_obj(o, memoize = True), objs))
+        self.assertEqual(hashes, [ md5_obj(o) for o in objs ])
+
+class TestWriteJSON(PlutoTestCase):
+    def test_write_json(self):
+        """
+        Test case for writing a Python object to a JSON file
+        """
+        obj = {
+            'input_file': {'class': 'File', 'path': '/foo/input.maf'},
+            'output_filename': 'output.maf',
+            'values': [1, 2.5, None, True]
+        }
+        for pretty in [True, False]:
+            filepath = os.path.join(self.tmpdir, "output.{}.json".format(pretty))
+            write_json(obj, filepath, pretty = pretty)
+            with open(filepath) as fin:
+                self.assertEqual(json.load(fin), obj)
+
+        # pretty output keeps the 4 space indent
+        filepath = write_json(obj, os.path.join(self.tmpdir, "output.pretty.json"))
+        with open(filepath) as fin:
+            self.assertEqual(fin.read(), json.dumps(obj, indent = 4))
 
+    def test_write_json_fallback(self):
+        """
+        Test case for writing objects that need the stdlib json module
+        """
+        objs = [
+            {1: 'int key'},
+            {'big': 123456789012345678901234567890},
+            {'nan': float('nan'), 'inf': float('inf'), 'none': None},
+        ]
+        for i, obj in enumerate(objs):
+            for pretty in [True, False]:
+                filepath = os.path.join(self.tmpdir, "output.{}.{}.json".format(i, pretty))
+                write_json(obj, filepath, pretty = pretty)
+                with open(filepath) as fin:
+                    self.assertEqual(fin.read(), json.dumps(obj, indent = 4 if pretty else None))
+
+    def test_loads_json(self):
+        """
+        Test case for parsing JSON output the same way as the stdlib json module
+        """
+        data = '{"output_file": {"class": "File", "size": 12}, "values": [1, 2.5, null, true]}'
+        self.assertEqual(loads_json(data), json.loads(data))
+        self.assertEqual(loads_json(data.encode()), json.loads(data))
+        with self.assertRaises(json.decoder.JSONDecodeError):
+            loads_json('not json')
+
+    def test_write_ndjson(self):
+        """
+        Test case for writing a dict to a newline-delimited JSON file with one key per line and reading it back
+        """
+        obj = {
+            'output_file': {'class': 'File', 'path': '/foo/output.maf'},
+            'output_files': [{'class': 'File', 'path': '/foo/1.maf'}, {'class': 'File', 'path': '/foo/2.maf'}],
+            'output_dir': None
+        }
+        filepath = write_ndjson(obj, os.path.join(self.tmpdir, "output.ndjson"))
+        with open(filepath) as fin:
+            lines = fin.readlines()
+        self.assertEqual([ json.loads(line) for line in lines ], [ {key: value} for key, value in obj.items() ])
+        self.assertEqual([ entry for entry in read_ndjson(filepath) ], [ {key: value} for key, value in obj.items() ])
+
+
+class TestRunCommand(PlutoTestCase):
+    def test_run_command_stream(self):
+        """
+        Test case for reading the stdout of a command as bytes while stderr is read separately
+        """
+        obj = {'output_file': {'class': 'File', 'path': '/foo/output.maf'}, 'values': list(range(50000))}
+        script = 'import sys, json; sys.stderr.write("warning\\n" * 10000); print(json.dumps({"output_file": {"class": "File", "path": "/foo/output.maf"}, "values": list(range(50000))}))'
+        returncode, proc_stdout, proc_stderr = run_command_stream([ sys.executable, '-c', script ], chunk_size = 1024)
+        self.assertEqual(returncode, 0)
+        self.assertEqual(loads_json(proc_stdout), obj)
+        self.assertEqual(proc_stderr, '\n'.join([ 'warning' ] * 10000))
+
+        script = 'import sys; [ sys.stderr.write("line {}\\n".format(i)) for i in range(10000) ]; print(1)'
+        returncode, proc_stdout, proc_stderr = run_command_stream([ sys.executable, '-c', script ], stderr_lines = 2)
+        self.assertEqual(loads_json(proc_stdout), 1)
+        self.assertEqual(proc_stderr, 'line 9998\nline 9999')
+
+        returncode, proc_stdout, proc_stderr = run_command_stream([ sys.executable, '-c', 'import sys; sys.exit(3)' ])
+        self.assertEqual(returncode, 3)
+        self.assertEqual(proc_stdout, b'')
+
+class TestCWLFile(PlutoTestCase):
+    def test_cwl_file_path(self):
+        """
+        Test case for resolving the full path to a CWL file
+        """
+        cwl_file = CWLFile('copy.cwl', CWL_DIR = '/foo/cwl')
+        self.assertEqual(cwl_file.path, '/foo/cwl/copy.cwl')
+        self.assertEqual(str(cwl_file), '/foo/cwl/copy.cwl')
+        self.assertEqual(os.fspath(cwl_file), '/foo/cwl/copy.cwl')
+        self.assertTrue(isinstance(cwl_file, os.PathLike))
+        self.assertFalse(hasattr(cwl_file, '__dict__'))
+
+        # wrapping an existing CWLFile keeps the same path
+        self.assertEqual(CWLFile(cwl_file).path, '/foo/cwl/copy.cwl')
+
+        # the path resolution is cached so repeated lookups share the same path string
+        self.assertTrue(CWLFile('copy.cwl', CWL_DIR = '/foo/cwl').path is cwl_file.path)
+
+        # and still share it after the cached lookup is gone
+        _resolve_cwl_path.cache_clear()
+        self.assertTrue(CWLFile('copy.cwl', CWL_DIR = '/foo/cwl').path is cwl_file.path)
+
+
+class TestCWLRunnerPool(PlutoTestCase):
+    def test_run_order(self):
+        """
+        Test that results from the pool come back in the same order as the runners
+        """
+        class Runner:
+            def __init__(self, i):
+                self.i = i
+            def run(self):
+                return(({'i': self.i}, str(self.i), str(self.i) + '.json'))
+
+        runners = [ Runner(i) for i in range(10) ]
+        with CWLRunnerPool(max_workers = 3) as pool:
+            results = pool.run(runners)
+        expected = [ ({'i': i}, str(i), str(i) + '.json') for i in range(10) ]
+        self.assertEqual(results, expected)
+
+
+class TestCWLWorker(PlutoTestCase):
+    CWL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cwl')
+    cwl_file = CWLFile('copy.cwl', CWL_DIR = CWL_DIR)
+
+    def test_worker_copy(self):
+        """
+        Test case for running the demo copy cwl in the cwltool worker process
+        """
+        try:
+            import cwltool
+        except ImportError:
+            raise unittest.SkipTest("cwltool is not installed")
+        input_maf = self.write_table(tmpdir = self.tmpdir, filename = 'input.maf', lines = [['Hugo_Symbol'], ['SUFU']])
+        input_json_file = write_json({"input_file": {"class": "File", "path": input_maf}, "output_filename": 'output.maf'}, os.path.join(self.tmpdir, "input.json"))
+        output_dir = os.path.join(self.tmpdir, "output")
+
+        worker = CWLWorker()
+        try:
+            returncode, proc_stdout, proc_stderr = worker.run([ "--outdir", output_dir, self.cwl_file, input_json_file ])
+        finally:
+            worker.close()
+        self.assertEqual(returncode, 0, proc_stderr)
+        output_json = json.loads(proc_stdout)
+        self.assertEqual(output_json['output_file']['path'], os.path.join(output_dir, 'output.maf'))
+        # the worker was stopped so it cannot be used any more
+        self.assertEqual(worker.run([ "--version" ]), None)
 
 
 has_cwl_runner = True if shutil.which('cwl-runner') else False
@@ -47,7 +273,7 @@ if not has_cwl_runner:
     print(">>> skipping tests that require cwl-runner")
 
 class TestCopyCWL(PlutoTestCase):
-    CWL_DIR = os.path.abspath('cwl')
+    CWL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cwl')
     cwl_file = CWLFile('copy.cwl', CWL_DIR = CWL_DIR)
 
     # @unittest.skipIf(has_cwl_runner!=True, "need cwl runner for this test")
@@ -99,6 +325,36 @@ class TestCopyCWL(PlutoTestCase):
             ]
         self.assertEqual(mutations, expected_mutations)
 
+    # @unittest.skipIf(has_cwl_runner!=True, "need cwl runner for this test")
+    def test_copy_batch(self):
+        """
+        Test case for running the demo copy cwl on several inputs at once
+        """
+        inputs = []
+        for i in range(3):
+            lines = [
+                ['# comment 1'],
+                ['Hugo_Symbol', 't_depth'],
+                ['SUFU', str(i)],
+            ]
+            input = self.write_table(tmpdir = self.tmpdir, filename = 'input{}.maf'.format(i), lines = lines)
+            inputs.append({
+                "input_file": {
+                      "class": "File",
+                      "path": input
+                    },
+                "output_filename":  'output{}.maf'.format(i),
+                })
+        results = self.run_cwl_batch(inputs, max_workers = 2)
+        self.assertEqual(len(results), 3)
+        # the run is marked in the tmpdir the same as with run_cwl
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, '{}.run'.format(self.test_label))))
+
+        for i, (output_json, output_dir) in enumerate(results):
+            self.assertEqual(output_dir, os.path.join(self.tmpdir, 'run-{}'.format(i), 'output'))
+            comments, mutations = self.load_mutations(output_json['output_file']['path'])
+            self.assertEqual(mutations, [{'Hugo_Symbol': 'SUFU', 't_depth': str(i)}])
+
     # @unittest.skipIf(has_cwl_runner!=True, "need cwl runner for this test")
     def test_copy2(self):
         comments = [
@@ -158,6 +414,72 @@ class TestCopyCWL(PlutoTestCase):
         self.assertEqual(mutations, expected_mutations)
 
 class TestPlutoTestCase(PlutoTestCase):
+    def test_rmtree(self):
+        """
+        Test that a directory gets deleted along with all of its contents
+        """
+        dir = os.path.join(self.tmpdir, 'foo')
+        os.makedirs(os.path.join(dir, 'bar', 'baz'))
+        write_table(tmpdir = os.path.join(dir, 'bar'), filename = 'input.maf', lines = [['Hugo_Symbol']])
+        os.symlink(self.tmpdir, os.path.join(dir, 'tmpdir_link'))
+        self.rmtree(dir)
+        self.assertFalse(os.path.exists(dir))
+        # symlinks to directories are removed without deleting the directory contents
+        self.assertTrue(os.path.isdir(self.tmpdir))
+
+    def test_read_table(self):
+        """
+        Test that the lines of a file are split on whitespace
+        """
+        filename = os.path.join(self.tmpdir, "file.txt")
+        with open(filename, "w") as fout:
+            fout.write('# comment\nfoo\tbar  baz \n\nfoo2\tbar2\n')
+        lines = self.read_table(filename)
+        expected = [['#', 'comment'], ['foo', 'bar', 'baz'], [], ['foo2', 'bar2']]
+        self.assertEqual(lines, expected)
+
+        # no newline at the end of the file
+        with open(filename, "w") as fout:
+            fout.write('foo\tbar\nfoo2\tbar2')
+        lines = self.read_table(filename)
+        self.assertEqual(lines, [['foo', 'bar'], ['foo2', 'bar2']])
+
+    @unittest.skipIf(KEEP_TMP, "tmpdirs are not reused when they are kept")
+    def test_tmpdir_reuse(self):
+        """
+        Test that the tmpdir gets emptied after a test case and reused by the next test case of the same class
+        """
+        tc = PlutoTestCase()
+        tc.setUp()
+        tmpdir = tc.tmpdir
+        # the reused tmpdir is only named after the class, not the test case that created it
+        self.assertTrue(os.path.basename(tmpdir).startswith('PlutoTestCase.'))
+        self.assertFalse(tc._testMethodName in os.path.basename(tmpdir))
+        os.makedirs(os.path.join(tmpdir, 'foo', 'bar'))
+        write_table(tmpdir = os.path.join(tmpdir, 'foo', 'bar'), filename = 'input.maf', lines = [['Hugo_Symbol']])
+        os.symlink(os.path.join(tmpdir, 'foo'), os.path.join(tmpdir, 'foo_link'))
+        tc.tearDown()
+        self.assertEqual(os.listdir(tmpdir), [])
+
+        tc = PlutoTestCase()
+        tc.setUp()
+        self.assertEqual(tc.tmpdir, tmpdir)
+        tc.tearDown()
+
+    def test_tmpdir_shm(self):
+        """
+        Test that the tmpdir is put in /dev/shm when the test case class sets use_shm
+        """
+        if not os.path.isdir('/dev/shm'):
+            raise unittest.SkipTest("/dev/shm does not exist")
+        class ShmTestCase(PlutoTestCase):
+            use_shm = True
+        tc = ShmTestCase()
+        tc.setUp()
+        tmpdir = tc.tmpdir
+        self.assertEqual(os.path.dirname(tmpdir), '/dev/shm')
+        tc.tearDown()
+
     def test_assertCWLDictEqual(self):
         """
         Test that CWL output dict objects have their keys stripped down to remove inconsistent output fields
@@ -243,3 +565,27 @@ class TestPlutoTestCase(PlutoTestCase):
 
         self.assertCWLDictEqual(d1, d2, related_keys = related_keys)
 
+
+    def test_assertCWLDictEqual_disposable(self):
+        """
+        Test that the dicts are only changed when assume_disposable is used
+        """
+        d1 = {'a':1, 'nameroot':'bar', 'b':[{'c':1, 'nameext': "foo"}]}
+        d2 = {'a':1, 'b':[{'c':1}]}
+        self.assertCWLDictEqual(d1, d2)
+        self.assertEqual(d1, {'a':1, 'nameroot':'bar', 'b':[{'c':1, 'nameext': "foo"}]})
+
+        self.assertCWLDictEqual(d1, d2, assume_disposable = True)
+        self.assertEqual(d1, d2)
+
+    def test_assertCWLDictEqual_replace_paths(self):
+        """
+        Test that outputs from different run dirs can be compared by replacing the dir paths
+        """
+        d1 = {'output_file': {'basename': 'foo.txt', 'class': 'File', 'path': '/run1/output/foo.txt', 'location': 'file:///run1/output/foo.txt'}}
+        d2 = {'output_file': {'basename': 'foo.txt', 'class': 'File', 'path': '/run2/output/foo.txt', 'location': 'file:///run2/output/foo.txt'}}
+        with self.assertRaises(AssertionError):
+            self.assertCWLDictEqual(d1, d2)
+        self.assertCWLDictEqual(d1, d2, replace_paths = {'/run1/': '<RUN>/', '/run2/': '<RUN>/'})
+        # original dicts are unchanged
+        self.assertEqual(d1['output_file']['path'], '/run1/output/foo.txt')
@@ -1,10 +1,71 @@
+import io
 import os
 import csv
 import json
+import math
 import gzip
 import hashlib
-from collections import OrderedDict
-from typing import List, Dict, Tuple, Union
+import threading
+from collections import namedtuple
+from itertools import islice
+from typing import IO, List, Dict, Tuple, Union, Iterable, Iterator, Literal, overload, TYPE_CHECKING
+from functools import lru_cache
+if TYPE_CHECKING:
+    # optional dependencies that are only imported when they are used; these are just for the type annotations
+    import numpy
+    import pyarrow
+
+@lru_cache(maxsize = None)
+def _get_orjson():
+    """
+    Import orjson the first time it is needed, returns None if it is not installed;
+    orjson is much faster than the stdlib json module but is not required,
+    and importing it up front slows down importing this module for code that never writes JSON
+    """
+    try:
+        import orjson
+    except ImportError:
+        return(None)
+    return(orjson)
+
+@lru_cache(maxsize = None)
+def _get_rapidgzip():
+    """
+    Import rapidgzip the first time it is needed, returns None if it is not installed;
+    rapidgzip decompresses .gz files in parallel and is much faster than the stdlib gzip module for large files, but is not required
+    """
+    try:
+        import rapidgzip
+    except ImportError:
+        return(None)
+    return(rapidgzip)
+
+# smallest .gz file size in bytes to decompress with rapidgzip; smaller files are not worth starting the decoder threads for
+_RAPIDGZIP_MIN_SIZE = 4 << 20
+
+def open_gzip(
+    filename: str, # path to the .gz file
+    mode: str = 'rt' # file mode; only reading uses rapidgzip
+    ) -> IO:
+    """
+    Open a .gz file for reading, using rapidgzip to decompress it in parallel if it is installed and the file is large enough,
+    otherwise the stdlib gzip module
+
+    Examples
+    --------
+    Example usage::
+
+        with open_gzip('input.maf.gz') as fin:
+            for line in fin:
+                ...
+    """
+    rapidgzip = _get_rapidgzip()
+    if rapidgzip is None or not mode.startswith('r') or os.path.getsize(filename) < _RAPIDGZIP_MIN_SIZE:
+        return(gzip.open(filename, mode))
+    fin = rapidgzip.open(filename, parallelization = os.cpu_count() or 1)
+    if 'b' in mode:
+        return(fin)
+    return(io.TextIOWrapper(fin))
 
 def write_table(
     tmpdir: str, # path to parent directory to save the file to
@@ -18,10 +79,14 @@ def write_table(
     """
     if not filepath:
         filepath = os.path.join(tmpdir, filename)
-    with open(filepath, "w") as f:
-        for line in lines:
-            line_str = delimiter.join(line) + '\n'
-            f.write(line_str)
+    # join the lines into large chunks and write each chunk at once instead of writing every line separately,
+    # without building the entire file contents in memory
+    lines = iter(lines)
+    with open(filepath, "w", buffering = 1 << 20) as f:
+        chunk = list(islice(lines, 4096))
+        while chunk:
+            f.write(''.join([ delimiter.join(line) + '\n' for line in chunk ]))
+            chunk = list(islice(lines, 4096))
     return(filepath)
 
 
@@ -43,6 +108,9 @@ def dicts2lines(
     ----
     Dict values must be type `str`
 
+    Values are put in the order of the fieldnames from all the dicts, so the dicts do not need to have their keys in the same order;
+    missing values are filled in with empty strings
+
     Examples
     --------
     Example usage::
@@ -56,26 +124,59 @@ def dicts2lines(
         >>> output_path = write_table(tmpdir = '.', filename = 'output.txt', lines = lines)
 
     """
-    fieldnames = OrderedDict() # use as an ordered set
-    # get the ordered fieldnames
-    for row in dict_list:
-        for key in row.keys():
-            fieldnames[key] = ''
+    # get the ordered fieldnames; dict keys are used as an ordered set
+    fieldnames = list(dict.fromkeys(key for row in dict_list for key in row))
     # list to hold the lines to be written out
-    demo_maf_lines = []
-    if comment_list:
-        for line in comment_list:
-            demo_maf_lines.append(line)
-    fieldnames = [ f for f in fieldnames.keys() ]
-    demo_maf_lines.append(fieldnames)
-    for row in dict_list:
-        demo_maf_lines.append([ v for v in row.values() ])
+    demo_maf_lines = [
+        *(comment_list or ()),
+        fieldnames,
+        *([ row.get(key, '') for key in fieldnames ] for row in dict_list)
+        ]
     return(demo_maf_lines)
 
+def write_dicts(
+    tmpdir: str, # path to parent directory to save the file to
+    filename: str, # basename for the file to write to
+    dict_list: Iterable[Dict], # the dicts with data to be written, one per line
+    comment_list: List[ List[str] ] = None, # a list of comment lines to write before the header line
+    delimiter: str = '\t', # character to join the line elements on
+    filepath: str = None, # full path to write the output file to; overrides tmpdir and filename
+    fieldnames: List[str] = None # the column names to write; by default all the keys from dict_list, in order
+    ) -> str:
+    """
+    Write a list of dicts to a table, the same as `write_table(dicts2lines(dict_list, comment_list))`
+    but without building the list of lines in memory first
+
+    Each line is built from the dict values in the order of `fieldnames`; missing values are written as empty strings
+
+    Note
+    ----
+    Pass `fieldnames` if `dict_list` is a generator, otherwise it gets used up finding the fieldnames
+
+    Examples
+    --------
+    Example usage::
+
+        >>> comments = [ ['# foo'] ]
+        >>> row1 = { 'a':'1', 'b':'2' }
+        >>> row2 = { 'a':'6', 'b':'7' }
+        >>> output_path = write_dicts(tmpdir = '.', filename = 'output.txt', dict_list = [row1, row2], comment_list = comments)
+    """
+    if fieldnames is None:
+        fieldnames = list(dict.fromkeys(key for row in dict_list for key in row))
+    def _lines():
+        if comment_list:
+            yield from comment_list
+        yield fieldnames
+        for row in dict_list:
+            yield [ row.get(key, '') for key in fieldnames ]
+    return(write_table(tmpdir = tmpdir, filename = filename, lines = _lines(), delimiter = delimiter, filepath = filepath))
+
 def clean_dicts(
     obj: Union[Dict, List],
     bad_keys: List[str] = ('nameext', 'nameroot'),
-    related_keys: List[ Tuple[str, str, List[str]] ] = None):
+    related_keys: List[ Tuple[str, str, List[str]] ] = None,
+    related_map: Dict[str, Dict] = None): # lookup table from related_keys_map(); used instead of related_keys if passed
     """
     Recursively remove all bad_keys from all dicts in the input obj
     Also, use "related_keys" to conditionally remove certain keys if a specific key:value pair is present
@@ -102,45 +203,215 @@ def clean_dicts(
         clean_dicts(d, related_keys = related_keys)
         self.assertDictEqual(d, expected)
 
+    """
+    # build the lookups once here instead of at every level of the recursion
+    if related_map is None:
+        related_map = related_keys_map(related_keys)
+    _clean_dicts(obj, bad_keys = frozenset(bad_keys), related_map = related_map)
+
+def clean_dicts_copy(
+    obj: Union[Dict, List],
+    bad_keys: List[str] = ('nameext', 'nameroot'),
+    related_keys: List[ Tuple[str, str, List[str]] ] = None,
+    related_map: Dict[str, Dict] = None) -> Union[Dict, List]: # lookup table from related_keys_map(); used instead of related_keys if passed
+    """
+    Same as `clean_dicts` but returns a cleaned copy of `obj` instead of modifying it
+
+    Only the dicts and lists that have keys removed somewhere inside them get copied,
+    anything that does not need cleaning is shared with `obj` instead of being copied,
+    so do not modify the returned object in place
+
+        d = {'a':1, 'nameext': "foo", 'b': {'c': 2}}
+        d_clean = clean_dicts_copy(d)
+        self.assertDictEqual(d_clean, {'a':1, 'b': {'c': 2}})
+        self.assertTrue(d_clean['b'] is d['b'])
+    """
+    if related_map is None:
+        related_map = related_keys_map(related_keys)
+    return(_clean_dicts_copy(obj, bad_keys = frozenset(bad_keys), related_map = related_map))
+
+def related_keys_map(
+    related_keys: List[ Tuple[str, str, List[str]] ] = None
+    ) -> Dict[str, Dict]:
+    """
+    Convert the `related_keys` list used by clean_dicts into a lookup table;
+    pass the result as `related_map` to clean_dicts to avoid rebuilding it for every call with the same `related_keys`
+
+    related_map = { "key_foo": { "value_foo": ("key1", "key2") }, ... }
     """
     if related_keys is None:
         related_keys = []
+    related_map = {}
+    for key, value, remove_keys in related_keys:
+        values = related_map.setdefault(key, {})
+        values[value] = values.get(value, ()) + tuple(remove_keys)
+    return(related_map)
 
-    # remove bad keys from top-level dict keys
-    if isinstance(obj, dict):
-        # ~~~~~~~~~ #
-        # NOTE: This is the terminal case for the recursion loop !!
-        # remove each key in the dict that is recognized as being unwanted
-        for bad_key in bad_keys:
-            obj.pop(bad_key, None)
-
-        # remove each unwanted key in the dict if some other key:value pair is found
-        for key_map in related_keys:
-            key = key_map[0] # key_map = ("key_foo", "value_foo", ["key1", "key2"])
-            value = key_map[1]
-            remove_keys = key_map[2] # probably need some kind of type-enforcement here
-            if (key, value) in obj.items():
+def _clean_dicts(
+    obj: Union[Dict, List],
+    bad_keys: frozenset,
+    related_map: Dict[str, Dict]):
+    """
+    Implementation of clean_dicts, using the pre-built `related_map` lookup
+
+    Walks the nested dicts and lists with a stack instead of recursion,
+    so deeply nested objects do not pay for a Python function call per node;
+    each dict is cleaned on its own so the order they are visited in does not matter
+    """
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            # remove each key in the dict that is recognized as being unwanted
+            for bad_key in bad_keys:
+                obj.pop(bad_key, None)
+
+            # remove each unwanted key in the dict if some other key:value pair is found
+            for key, values in related_map.items():
+                if key not in obj:
+                    continue
+                try:
+                    remove_keys = values.get(obj[key], ())
+                except TypeError: # unhashable value like a list or dict can never match
+                    continue
                 for remove_key in remove_keys:
                     obj.pop(remove_key, None)
-        # ~~~~~~~~~ #
-
-        # recurse to clear out bad keys from nested list values
-        # obj = { 'foo': [i, j, k, ...],
-        #         'bar': {'baz': [q, r, s, ...]} }
-        for key in obj.keys():
-            # 'foo': [i, j, k, ...]
-            if isinstance(obj[key], list):
-                for i in obj[key]:
-                    clean_dicts(obj = i, bad_keys = bad_keys, related_keys = related_keys)
-
-            # 'bar': {'baz': [q, r, s, ...]}
-            elif isinstance(obj[key], dict):
-                clean_dicts(obj = obj[key], bad_keys = bad_keys, related_keys = related_keys)
-
-    # recurse to clear out bad keys from nested list values
+
+            # clear out bad keys from nested list and dict values; removed keys are never visited
+            # obj = { 'foo': [i, j, k, ...],
+            #         'bar': {'baz': [q, r, s, ...]} }
+            stack.extend(value for value in obj.values() if isinstance(value, (list, dict)))
+
+        # clear out bad keys from nested list values
+        elif isinstance(obj, list):
+            stack.extend(item for item in obj if isinstance(item, (list, dict)))
+
+def replace_in_strings(
+    obj: Union[Dict, List, str],
+    replacements: Dict[str, str] # mapping of substrings to replace, to their replacement strings
+    ) -> Union[Dict, List, str]:
+    """
+    Replace substrings in all the string values in nested dicts and lists, such as a run directory path in CWL output 'path' and 'location' entries,
+    so that objects from different runs can be compared directly
+
+    Returns a copy of `obj`; like clean_dicts_copy, only the dicts and lists that contain changed strings get copied,
+    so do not modify the returned object in place
+
+        d = {'path': '/tmp/run1/output/foo.txt', 'location': 'file:///tmp/run1/output/foo.txt', 'size': 1}
+        replace_in_strings(d, {'/tmp/run1': '<TMPDIR>'})
+        {'path': '<TMPDIR>/output/foo.txt', 'location': 'file://<TMPDIR>/output/foo.txt', 'size': 1}
+    """
+    if isinstance(obj, str):
+        new_obj = obj
+        for old, new in replacements.items():
+            if old in new_obj:
+                new_obj = new_obj.replace(old, new)
+        return(new_obj if new_obj != obj else obj)
+
+    elif isinstance(obj, dict):
+        changed = False
+        items = []
+        for key, value in obj.items():
+            new_value = replace_in_strings(value, replacements)
+            if new_value is not value:
+                changed = True
+            items.append((key, new_value))
+        if not changed:
+            return(obj)
+        return(dict(items))
+
+    elif isinstance(obj, list):
+        changed = False
+        items = []
+        for item in obj:
+            new_item = replace_in_strings(item, replacements)
+            if new_item is not item:
+                changed = True
+            items.append(new_item)
+        if not changed:
+            return(obj)
+        return(items)
+
+    return(obj)
+
+def _clean_dicts_copy(
+    obj: Union[Dict, List],
+    bad_keys: frozenset,
+    related_map: Dict[str, Dict]) -> Union[Dict, List]:
+    """
+    Recursive implementation of clean_dicts_copy; returns `obj` itself if nothing inside it needed to be removed
+    """
+    if isinstance(obj, dict):
+        # find the keys to remove, in the same order that _clean_dicts removes them
+        remove_keys = bad_keys.intersection(obj)
+        for key, values in related_map.items():
+            if key not in obj or key in remove_keys:
+                continue
+            try:
+                related_remove_keys = values.get(obj[key], ())
+            except TypeError: # unhashable value like a list or dict can never match
+                continue
+            if related_remove_keys:
+                remove_keys = remove_keys.union(related_remove_keys)
+
+        changed = bool(remove_keys)
+        items = []
+        for key, value in obj.items():
+            if key in remove_keys:
+                continue
+            if isinstance(value, (list, dict)):
+                new_value = _clean_dicts_copy(value, bad_keys = bad_keys, related_map = related_map)
+                if new_value is not value:
+                    changed = True
+                    value = new_value
+            items.append((key, value))
+        if not changed:
+            return(obj)
+        return(dict(items))
+
     elif isinstance(obj, list):
+        changed = False
+        items = []
         for item in obj:
-            clean_dicts(obj = item, bad_keys = bad_keys, related_keys = related_keys)
+            new_item = _clean_dicts_copy(item, bad_keys = bad_keys, related_map = related_map)
+            if new_item is not item:
+                changed = True
+            items.append(new_item)
+        if not changed:
+            return(obj)
+        return(items)
+
+    return(obj)
+
+def read_header_comments(
+    fin: IO[str], # open file handle positioned at the start of the file
+    comment_char: str = '#', # comment character
+    ignore_comments: bool = False) -> Tuple[ List[str], int, str ]:
+    """
+    Read the comment lines from the header of an open file
+
+    Returns the comments, the number of comment lines, and the first line after the comments (empty string if there was none).
+    Uses `readline` so that `fin.tell()` still works afterwards
+
+    Examples
+    --------
+    Example usage::
+
+        with open(filename) as fin:
+            comments, start_line, header_line = read_header_comments(fin)
+            reader = csv.reader(fin, delimiter = '\t')
+            fieldnames = next(csv.reader([header_line], delimiter = '\t'))
+    """
+    comments = []
+    start_line = 0
+    # find the first line without comments
+    line = fin.readline()
+    while line.startswith(comment_char):
+        if not ignore_comments:
+            comments.append(line.strip())
+        start_line += 1
+        line = fin.readline()
+    return(comments, start_line, line)
 
 def parse_header_comments(
     filename: str, # path to input file
@@ -149,46 +420,62 @@ def parse_header_comments(
     """
     Parse a file with comments in its header to return the comments and the line number to start reader from.
 
+    Only reads up to the first line without a comment. To read the table rows as well,
+    use `read_header_comments` on the open file instead so the file does not need to be opened and skipped through a second time
+
     Examples
     --------
     Example usage::
 
         comments, start_line = parse_header_comments(filename)
+
+        # single pass over the file
         with open(portal_file) as fin:
-            while start_line > 0:
-                next(fin)
-                start_line -= 1
-            reader = csv.DictReader(fin, delimiter = '\t') # header_line = next(fin)
+            comments, start_line, header_line = read_header_comments(fin)
+            reader = csv.DictReader(itertools.chain([header_line], fin), delimiter = '\t')
             portal_lines = [ row for row in reader ]
     """
-    comments = []
-    start_line = 0
-
-    is_gz = False
-    if filename.endswith('.gz'):
-        is_gz = True
+    with _open_text(filename) as fin:
+        comments, start_line, _ = read_header_comments(fin, comment_char = comment_char, ignore_comments = ignore_comments)
+    return(comments, start_line)
 
-    if is_gz:
-        fin = gzip.open(filename, 'rt')
-    else:
-        fin = open(filename)
+def rows2dicts(
+    rows: Iterable[ List[str] ], # rows from a csv.reader, not including the header row
+    fieldnames: List[str] # the header fieldnames for the rows
+    ) -> Iterator[Dict]:
+    """
+    Convert rows of values into dicts keyed by fieldnames, with the same output as `csv.DictReader`
 
-    # find the first line without comments
-    for i, line in enumerate(fin):
-        if str(line).startswith(comment_char):
-            if not ignore_comments:
-                comments.append(line.strip())
-            start_line += 1
-        else:
-            break
-    fin.close()
-    return(comments, start_line)
+    Uses `dict(zip(...))` for the common case of a row with a value for each fieldname,
+    which is much faster than `csv.DictReader`; blank rows are skipped, missing values are filled with `None`,
+    and extra values are stored under the `None` key, same as `csv.DictReader`
+    """
+    num_fields = len(fieldnames)
+    for row in rows:
+        if not row:
+            continue
+        record = dict(zip(fieldnames, row))
+        num_values = len(row)
+        if num_values > num_fields:
+            record[None] = row[num_fields:]
+        elif num_values < num_fields:
+            for key in fieldnames[num_values:]:
+                record[key] = None
+        yield(record)
 
+# as_records changes the type of the mutations that are returned
+@overload
+def load_mutations(filename: str, strip: bool = ..., strip_keys: list = ..., as_records: Literal[False] = ...) -> Tuple[ List[str], List[Dict] ]: ...
+@overload
+def load_mutations(filename: str, strip: bool = ..., strip_keys: list = ..., *, as_records: Literal[True]) -> Tuple[ List[str], List[tuple] ]: ...
+@overload
+def load_mutations(filename: str, strip: bool = ..., strip_keys: list = ..., as_records: bool = ...) -> Tuple[ List[str], Union[ List[Dict], List[tuple] ] ]: ...
 def load_mutations(
         filename: str, # input file name
         strip: bool = False, # strip some extra keys from the mutations
-        strip_keys: list = ('all_effects', 'Consequence', 'Variant_Classification')
-        ) -> Tuple[ List[str], List[Dict] ]:
+        strip_keys: list = ('all_effects', 'Consequence', 'Variant_Classification'),
+        as_records: bool = False # return each mutation as a namedtuple instead of a dict
+        ) -> Tuple[ List[str], Union[ List[Dict], List[tuple] ] ]:
     """
     Load the mutations from a tabular .maf file
 
@@ -205,55 +492,577 @@ def load_mutations(
         >>> comments
         ['# version 2.4']
         >>> mutations
-        [OrderedDict([('Hugo_Symbol', 'SOX9'), ('Chromosome', '1')]), OrderedDict([('Hugo_Symbol', 'BRCA'), ('Chromosome', '7')])]
+        [{'Hugo_Symbol': 'SOX9', 'Chromosome': '1'}, {'Hugo_Symbol': 'BRCA', 'Chromosome': '7'}]
+        >>> comments, mutations = load_mutations(output_path, as_records = True)
+        >>> mutations
+        [Mutation(Hugo_Symbol='SOX9', Chromosome='1'), Mutation(Hugo_Symbol='BRCA', Chromosome='7')]
+        >>> mutations[0]._asdict()
+        {'Hugo_Symbol': 'SOX9', 'Chromosome': '1'}
+
+    Notes
+    -----
+    Loads all mutation records into memory at once; use iter_mutations to read them one at a time instead
+
+    Records from `as_records` use much less memory than dicts for large files and compare as plain tuples;
+    column names that are not valid Python identifiers get renamed to `_<index>`, missing values are `None`, and extra values are dropped
+    """
+    # read the comments and the mutations in a single pass over the file
+    with _open_text(filename) as fin:
+        comments, start_line, header_line = read_header_comments(fin)
+        mutations: Union[ List[Dict], List[tuple] ]
+        if as_records:
+            mutations = [ mut for mut in _iter_mutation_records(fin, header_line = header_line, strip = strip, strip_keys = strip_keys) ]
+        else:
+            mutations = [ mut for mut in _iter_mutations(fin, header_line = header_line, strip = strip, strip_keys = strip_keys) ]
+    return(comments, mutations)
+
+@overload
+def iter_mutations(filename: str, strip: bool = ..., strip_keys: list = ..., as_records: Literal[False] = ...) -> Tuple[ List[str], Iterator[Dict] ]: ...
+@overload
+def iter_mutations(filename: str, strip: bool = ..., strip_keys: list = ..., *, as_records: Literal[True]) -> Tuple[ List[str], Iterator[tuple] ]: ...
+@overload
+def iter_mutations(filename: str, strip: bool = ..., strip_keys: list = ..., as_records: bool = ...) -> Tuple[ List[str], Union[ Iterator[Dict], Iterator[tuple] ] ]: ...
+def iter_mutations(
+        filename: str, # input file name
+        strip: bool = False, # strip some extra keys from the mutations, same as load_mutations
+        strip_keys: list = ('all_effects', 'Consequence', 'Variant_Classification'),
+        as_records: bool = False # return each mutation as a namedtuple instead of a dict, same as load_mutations
+        ) -> Tuple[ List[str], Union[ Iterator[Dict], Iterator[tuple] ] ]:
+    """
+    Get the comments from a tabular .maf file and a generator that reads its mutations one at a time,
+    for going over the mutations in a large file without loading all of them into memory
+
+    Examples
+    --------
+    Example usage::
+
+        comments, mutations = iter_mutations(output_path)
+        num_mutations = sum(1 for mut in mutations)
 
     Notes
     -----
-    Loads all mutation records into memory at once; for large datasets use TableReader to iterate over records instead
+    The comments are read right away, but the file is not opened for the mutations until the generator is first iterated over;
+    it stays open until the generator is exhausted or closed, and can only be iterated over once
     """
     comments, start_line = parse_header_comments(filename)
+    mutations = _iter_mutations_file(filename, strip = strip, strip_keys = strip_keys, as_records = as_records)
+    return(comments, mutations)
 
-    is_gz = False
-    if filename.endswith('.gz'):
-        is_gz = True
+def load_mutations_many(
+        filenames: List[str], # input file names
+        *args, # passed to load_mutations
+        max_workers: int = 8, # max number of files to read at the same time
+        **kwargs # passed to load_mutations
+        ) -> List[ Tuple[ List[str], List[Dict] ] ]:
+    """
+    Load the mutations from several .maf files, reading the files at the same time in separate threads
 
-    if is_gz:
-        fin = gzip.open(filename, 'rt')
-    else:
-        fin = open(filename)
+    Returns the `(comments, mutations)` from load_mutations for each file, in the same order as `filenames`
 
-    # with open(filename) as fin:
-    while start_line > 0:
-        next(fin)
-        start_line -= 1
-    reader = csv.DictReader(fin, delimiter = '\t')
-    mutations = [ row for row in reader ]
+    Examples
+    --------
+    Example usage::
 
-    if strip:
-        for mut in mutations:
+        results = load_mutations_many([ 'Sample1.maf', 'Sample2.maf' ], strip = True)
+        for comments, mutations in results:
+            ...
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    filenames = list(filenames)
+    if len(filenames) < 2:
+        return([ load_mutations(filename, *args, **kwargs) for filename in filenames ])
+    with ThreadPoolExecutor(max_workers = min(max_workers, len(filenames))) as executor:
+        futures = [ executor.submit(load_mutations, filename, *args, **kwargs) for filename in filenames ]
+        results = [ future.result() for future in futures ]
+    return(results)
+
+def _open_text(filename: str) -> IO[str]:
+    """
+    Open a file for reading text, handles .gz files automatically
+    """
+    if filename.endswith('.gz'):
+        return(open_gzip(filename, 'rt'))
+    return(open(filename))
+
+def _iter_mutations_file(
+        filename: str, # input file name
+        strip: bool,
+        strip_keys: list,
+        as_records: bool
+        ) -> Iterator:
+    """
+    Generator for the mutation records in a file, used by iter_mutations; the file is only opened once iteration starts
+    """
+    with _open_text(filename) as fin:
+        comments, start_line, header_line = read_header_comments(fin, ignore_comments = True)
+        if as_records:
+            yield from _iter_mutation_records(fin, header_line = header_line, strip = strip, strip_keys = strip_keys)
+        else:
+            yield from _iter_mutations(fin, header_line = header_line, strip = strip, strip_keys = strip_keys)
+
+def _iter_mutations(
+        fin: IO[str], # open file handle positioned after the header line
+        header_line: str, # the header line of the table
+        strip: bool,
+        strip_keys: list
+        ) -> Iterator[Dict]:
+    """
+    Generator for the mutation records in a file, used by load_mutations
+    """
+    fieldnames = next(csv.reader([header_line], delimiter = '\t'), []) if header_line else []
+    reader = csv.reader(fin, delimiter = '\t')
+    for mut in rows2dicts(reader, fieldnames):
+        if strip:
             for key in strip_keys:
                 mut.pop(key, None)
+        yield(mut)
+
+def _iter_mutation_records(
+        fin: IO[str], # open file handle positioned after the header line
+        header_line: str, # the header line of the table
+        strip: bool,
+        strip_keys: list
+        ) -> Iterator[tuple]:
+    """
+    Generator for the mutation records in a file as namedtuples, used by load_mutations
+    """
+    fieldnames = next(csv.reader([header_line], delimiter = '\t'), []) if header_line else []
+    num_fields = len(fieldnames)
+    # indexes of the fields to keep in each record
+    keep = [ i for i, name in enumerate(fieldnames) if not (strip and name in strip_keys) ]
+    Mutation = namedtuple('Mutation', [ fieldnames[i] for i in keep ], rename = True)
+    make = Mutation._make
+    reader = csv.reader(fin, delimiter = '\t')
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < num_fields:
+            row = row + [ None ] * (num_fields - len(row))
+        yield(make([ row[i] for i in keep ]))
+
+def load_mutations_rows(
+        filename: str, # input file name
+        columns: List[str] = None, # only load these columns from the file, in this order; loads all columns by default
+        strip: bool = False, # leave out some extra columns from the mutations, same as load_mutations
+        strip_keys: list = ('all_effects', 'Consequence', 'Variant_Classification')
+        ) -> Tuple[ List[str], List[str], List[ List[str] ] ]:
+    """
+    Load the mutations from a tabular .maf file as lists of values instead of dicts,
+    by splitting each line on tabs without building a dict for every row
+
+    Returns the comments, the column names for the values in each row, and the rows
+
+    Examples
+    --------
+    Example usage::
+
+        >>> comments, header, rows = load_mutations_rows(output_path, columns = ['Hugo_Symbol', 't_depth'])
+        >>> header
+        ['Hugo_Symbol', 't_depth']
+        >>> rows
+        [['SOX9', '100'], ['BRCA', '100']]
+
+    Notes
+    -----
+    Lines are split on tabs directly, so quoted values containing tabs are not supported (MAF files do not quote values);
+    blank lines are skipped and missing values are `None` when selecting columns
+    """
+    with _open_text(filename) as fin:
+        comments, start_line, header_line = read_header_comments(fin)
+        fieldnames = header_line.rstrip('\r\n').split('\t') if header_line else []
+        if columns is None:
+            columns = fieldnames
+        if strip:
+            columns = [ name for name in columns if name not in strip_keys ]
+        # pick out the values for the selected columns by position; not needed if all the columns are used as-is
+        indexes = None
+        if columns != fieldnames:
+            # raises ValueError if a column is not in the table
+            indexes = [ fieldnames.index(name) for name in columns ]
+        num_fields = len(fieldnames)
+        rows = []
+        for line in fin:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            values = line.split('\t')
+            if indexes is not None:
+                if len(values) < num_fields:
+                    values += [ None ] * (num_fields - len(values))
+                values = [ values[i] for i in indexes ]
+            rows.append(values)
+    return(comments, list(columns), rows)
+
+def load_mutations_np(
+        filename: str # input file name
+        ) -> Tuple[ List[str], 'numpy.ndarray' ]:
+    """
+    Load the mutations from a tabular .maf file into a NumPy structured array,
+    so that comparisons across all mutations can be done on whole columns at once instead of one dict at a time
+
+    Requires numpy to be installed
+
+    Examples
+    --------
+    Example usage::
+
+        >>> comments, mutations = load_mutations_np(output_path)
+        >>> mutations['Hugo_Symbol']
+        array(['SOX9', 'BRCA'], dtype='<U4')
+        >>> int((mutations['Chromosome'] == '7').sum())
+        1
+
+    Notes
+    -----
+    All fields are loaded as strings, the same as load_mutations; missing fields are loaded as empty strings
+    """
+    import numpy as np
+    with _open_text(filename) as fin:
+        comments, start_line, header_line = read_header_comments(fin)
+        fieldnames = next(csv.reader([header_line], delimiter = '\t'), []) if header_line else []
+        reader = csv.reader(fin, delimiter = '\t')
+        num_fields = len(fieldnames)
+        # pad short rows to the full number of fields, same as the missing values in load_mutations
+        rows = [ row + [''] * (num_fields - len(row)) if len(row) < num_fields else row[:num_fields] for row in reader if row ]
+    # build each column separately so that every column gets its own string width
+    columns = [ np.array(column, dtype = str) for column in zip(*rows) ] if rows else [ np.array([], dtype = str) for _ in fieldnames ]
+    dtype = [ (name, column.dtype) for name, column in zip(fieldnames, columns) ]
+    mutations = np.empty(len(rows), dtype = dtype)
+    for name, column in zip(fieldnames, columns):
+        mutations[name] = column
+    return(comments, mutations)
+
+def load_mutations_arrow(
+        filename: str, # input file name
+        columns: List[str] = None, # only load these columns from the file; loads all columns by default
+        strip: bool = False, # leave out some extra columns from the mutations, same as load_mutations
+        strip_keys: list = ('all_effects', 'Consequence', 'Variant_Classification')
+        ) -> Tuple[ List[str], 'pyarrow.Table' ]:
+    """
+    Load the mutations from a tabular .maf file into a pyarrow Table,
+    which is parsed in C++ into columns instead of building a Python dict for every mutation
+
+    Requires pyarrow to be installed
 
-    fin.close()
+    Examples
+    --------
+    Example usage::
+
+        >>> comments, mutations = load_mutations_arrow(output_path, columns = ['Hugo_Symbol', 't_depth'])
+        >>> mutations.column('Hugo_Symbol').to_pylist()
+        ['SOX9', 'BRCA']
+        >>> # same records as load_mutations, for the columns that were loaded
+        >>> mutations.to_pylist()
+        [{'Hugo_Symbol': 'SOX9', 't_depth': '100'}, {'Hugo_Symbol': 'BRCA', 't_depth': '100'}]
+
+    Notes
+    -----
+    All fields are loaded as strings, the same as load_mutations; with `strip`, the `strip_keys` columns are skipped by the parser
+    instead of being removed from every record afterwards
+
+    This is stricter than load_mutations: every row must have the same number of fields as the header,
+    rows with missing or extra values raise `pyarrow.lib.ArrowInvalid` instead of being padded with `None`;
+    use load_mutations for tables that might have ragged rows
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    with _open_text(filename) as fin:
+        comments, start_line, header_line = read_header_comments(fin)
+    fieldnames = next(csv.reader([header_line], delimiter = '\t'), []) if header_line else []
+    if strip:
+        if columns is None:
+            columns = fieldnames
+        columns = [ name for name in columns if name not in strip_keys ]
+    read_options = pa_csv.ReadOptions(skip_rows = start_line)
+    parse_options = pa_csv.ParseOptions(delimiter = '\t')
+    # keep every column as strings instead of letting pyarrow guess the types
+    convert_options = pa_csv.ConvertOptions(
+        column_types = { name: pa.string() for name in fieldnames },
+        include_columns = columns)
+    # .gz files are decompressed automatically based on the file extension
+    mutations = pa_csv.read_csv(filename,
+        read_options = read_options,
+        parse_options = parse_options,
+        convert_options = convert_options)
     return(comments, mutations)
 
+def _has_non_finite(obj: object) -> bool:
+    """
+    Check if there are any NaN or Infinity floats anywhere in a JSON-serializable object
+    """
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, float):
+            if not math.isfinite(obj):
+                return(True)
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return(False)
+
+def write_json(
+    obj: object, # JSON-serializable object to write
+    filepath: str, # path to the output JSON file
+    pretty: bool = True # indent the output for readability
+    ) -> str:
+    """
+    Write an object to a JSON file, using orjson for compact output if it is available
+
+    Note
+    ----
+    Pretty-printed output always uses the stdlib json module with an indent of 4, since orjson only supports an indent of 2.
+    Falls back to the stdlib json module for anything orjson cannot write the same way, such as non-str dict keys,
+    integers larger than 64 bits, and NaN or Infinity (which orjson would write as `null`)
+    """
+    orjson = _get_orjson()
+    if orjson is not None and not pretty:
+        # serialize before opening the file so that the file is not left empty if orjson cannot handle the object
+        try:
+            data = orjson.dumps(obj)
+        except (TypeError, orjson.JSONEncodeError):
+            data = None
+        # orjson writes NaN and Infinity as null; only check for them when there is a null in the output
+        if data is not None and (b'null' not in data or not _has_non_finite(obj)):
+            with open(filepath, "wb") as fout:
+                fout.write(data)
+            return(filepath)
+    with open(filepath, "w") as fout:
+        json.dump(obj, fout, indent = 4 if pretty else None)
+    return(filepath)
+
+def write_ndjson(
+    obj: Dict, # JSON-serializable dict to write, such as a CWL output dict
+    filepath: str # path to the output newline-delimited JSON file
+    ) -> str:
+    """
+    Write a dict to a newline-delimited JSON file with one `{key: value}` object per line,
+    using orjson if it is available
+
+    This lets the entries be read back one at a time with `read_ndjson` instead of loading the entire file
+
+    Examples
+    --------
+    Example usage::
+
+        >>> write_ndjson({'output_file': {'class': 'File', 'basename': 'output.maf'}, 'output_dir': {'class': 'Directory'}}, 'output.ndjson')
+        >>> print(open('output.ndjson').read())
+        {"output_file":{"class":"File","basename":"output.maf"}}
+        {"output_dir":{"class":"Directory"}}
+    """
+    orjson = _get_orjson()
+    with open(filepath, "wb", buffering = 1 << 20) as fout:
+        for key, value in obj.items():
+            if orjson is not None:
+                fout.write(orjson.dumps({key: value}, option = orjson.OPT_APPEND_NEWLINE))
+            else:
+                fout.write(json.dumps({key: value}, separators = (',', ':')).encode() + b'\n')
+    return(filepath)
+
+def read_ndjson(
+    filepath: str # path to a newline-delimited JSON file
+    ) -> Iterator[Dict]:
+    """
+    Read the objects from a newline-delimited JSON file one line at a time
+
+    Examples
+    --------
+    Example usage::
+
+        for entry in read_ndjson(output_ndjson_file):
+            for key, value in entry.items():
+                ...
+
+        # or load the whole file back into a single dict
+        output_json = { key: value for entry in read_ndjson(output_ndjson_file) for key, value in entry.items() }
+    """
+    with open(filepath, "rb") as fin:
+        for line in fin:
+            if line.strip():
+                yield(loads_json(line))
+
+def loads_json(
+    data: Union[str, bytes] # JSON text to parse
+    ) -> object:
+    """
+    Parse a JSON string, using orjson if it is available
+
+    Falls back to the stdlib json module for anything orjson refuses to parse, so that invalid JSON
+    still raises `json.decoder.JSONDecodeError` either way
+
+    Examples
+    --------
+    Example usage::
+
+        returncode, proc_stdout, proc_stderr = run_command(command)
+        output_json = loads_json(proc_stdout)
+    """
+    orjson = _get_orjson()
+    if orjson is not None:
+        try:
+            return(orjson.loads(data))
+        except orjson.JSONDecodeError:
+            pass
+    return(json.loads(data))
+
 def md5_file(filename: str) -> str:
     """
-    Get md5sum of a file by reading it in small chunks. This avoids issues with Python memory usage when hashing large files.
+    Get md5sum of a file by reading it in chunks. This avoids issues with Python memory usage when hashing large files.
+
+    Uses `hashlib.file_digest` on Python 3.11+, which runs the read loop in C
     """
     with open(filename, "rb") as f:
-        file_hash = hashlib.md5()
-        chunk = f.read(8192)
-        while chunk:
-            file_hash.update(chunk)
-            chunk = f.read(8192)
+        if hasattr(hashlib, 'file_digest'):
+            file_hash = hashlib.file_digest(f, 'md5')
+        else:
+            file_hash = hashlib.md5()
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(chunk)
     hash = file_hash.hexdigest()
     return(hash)
 
 
-def md5_obj(obj: object) -> str:
+def hash_file(
+    filename: str, # path to the file to hash
+    algorithm: str = 'blake2b' # name of a hashlib algorithm, or 'blake3' if the blake3 package is installed
+    ) -> str:
+    """
+    Get the hash of a file with any hashlib algorithm, or with BLAKE3 which hashes with SIMD and multiple threads
+
+    Use this for new checksums where md5 is not required; keep using md5_file wherever the hash is compared against a recorded md5sum
+
+    Examples
+    --------
+    Example usage::
+
+        blake2b_hash = hash_file('output.maf')
+        blake3_hash = hash_file('output.maf', 'blake3')
+    """
+    if algorithm == 'blake3':
+        import blake3
+        file_hash = blake3.blake3(max_threads = blake3.blake3.AUTO)
+        file_hash.update_mmap(filename)
+        return(file_hash.hexdigest())
+    with open(filename, "rb") as f:
+        if hasattr(hashlib, 'file_digest'):
+            file_hash = hashlib.file_digest(f, algorithm)
+        else:
+            file_hash = hashlib.new(algorithm)
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(chunk)
+    return(file_hash.hexdigest())
+
+def md5_files(
+    filenames: List[str], # paths to the files to hash
+    max_workers: int = 8 # max number of files to hash at the same time
+    ) -> Dict[str, str]:
+    """
+    Get the md5sum of several files, hashing the files at the same time in separate threads
+
+    hashlib releases the GIL while it hashes, so the reads and hashes for different files can overlap
+    instead of the disk sitting idle while each file is hashed in turn
+
+    Examples
+    --------
+    Example usage::
+
+        >>> md5_files([ 'Sample1.maf', 'Sample2.maf' ])
+        {'Sample1.maf': '584d00e49b0bd7f963af1db46a61d2f0', 'Sample2.maf': '7cfd59d3f19d43c39c7cae7e9c79c87f'}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    filenames = list(filenames)
+    if len(filenames) < 2:
+        return({ filename: md5_file(filename) for filename in filenames })
+    with ThreadPoolExecutor(max_workers = min(max_workers, len(filenames))) as executor:
+        hashes = executor.map(md5_file, filenames)
+        return(dict(zip(filenames, hashes)))
+
+def file_digests(
+    filename: str, # path to the file to hash
+    algorithms: Tuple[str, ...] = ('md5', 'sha1') # names of hashlib algorithms to use
+    ) -> Dict[str, str]:
+    """
+    Get several hashes of a file in a single read pass over the file,
+    instead of reading the whole file again for each hash
+
+    Examples
+    --------
+    Example usage::
+
+        >>> file_digests('output.maf')
+        {'md5': '584d00e49b0bd7f963af1db46a61d2f0', 'sha1': '7cfd59d3f19d43c39c7cae7e9c79c87fe1e671b0'}
+        >>> # compare against a CWL output checksum
+        >>> output_json['output_file']['checksum'] == 'sha1$' + file_digests(path, ['sha1'])['sha1']
+    """
+    hashes = { algorithm: hashlib.new(algorithm) for algorithm in algorithms }
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            for file_hash in hashes.values():
+                file_hash.update(chunk)
+    digests = { algorithm: file_hash.hexdigest() for algorithm, file_hash in hashes.items() }
+    return(digests)
+
+_md5_obj_encoder = json.JSONEncoder(sort_keys = True)
+
+# hashes from md5_obj(memoize = True), keyed on id(obj); the object is kept with its hash
+# so that its id cannot be reused by a different object while it is in the cache
+_md5_obj_cache: Dict[int, Tuple[object, str]] = {}
+_MD5_OBJ_CACHE_SIZE = 128
+_md5_obj_cache_lock = threading.Lock()
+
+def md5_obj(
+    obj: object, # JSON serializable object to hash
+    stream: bool = False, # hash the JSON incrementally instead of building the entire JSON string in memory
+    chunk_size: int = 1 << 16, # number of characters of JSON to buffer between hash updates when streaming
+    memoize: bool = False # reuse the hash from the last time this same object was hashed with memoize = True
+    ) -> str:
     """
     Get the md5sum of a Python object in memory by converting it to JSON
+
+    Note
+    ----
+    Using stream = True gives the same hash but avoids holding both the full JSON string and its encoded bytes in memory at once,
+    at the cost of using the slower pure-Python JSON encoder; only worth it for very large objects
+
+    Using memoize = True skips hashing the same object again, for objects that get hashed over and over (e.g. once per assertion);
+    only use it for objects that are not modified afterwards, since a modified object would still get its old hash
+
+    Examples
+    --------
+    Example usage::
+
+        md5_obj({'foo': 1}) == md5_obj({'foo': 1}, stream = True)
+
+        hash = md5_obj(output_json, memoize = True)
     """
-    hash = hashlib.md5(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+    if memoize:
+        with _md5_obj_cache_lock:
+            cached = _md5_obj_cache.get(id(obj))
+        if cached is not None and cached[0] is obj:
+            return(cached[1])
+
+    if not stream:
+        hash = hashlib.md5(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+    else:
+        obj_hash = hashlib.md5()
+        buffer = []
+        buffer_size = 0
+        for chunk in _md5_obj_encoder.iterencode(obj):
+            buffer.append(chunk)
+            buffer_size += len(chunk)
+            if buffer_size >= chunk_size:
+                obj_hash.update(''.join(buffer).encode('utf-8'))
+                buffer = []
+                buffer_size = 0
+        obj_hash.update(''.join(buffer).encode('utf-8'))
+        hash = obj_hash.hexdigest()
+
+    if memoize:
+        # the cache is shared between threads, e.g. test cases run concurrently
+        with _md5_obj_cache_lock:
+            # drop the oldest entry once the cache is full
+            if len(_md5_obj_cache) >= _MD5_OBJ_CACHE_SIZE:
+                _md5_obj_cache.pop(next(iter(_md5_obj_cache)), None)
+            _md5_obj_cache[id(obj)] = (obj, hash)
     return(hash)
\ No newline at end of file